@@ -0,0 +1,51 @@
+# Per-record add_* calls vs CoreDbConfig.load_config on a generated config
+# Run from the repo root: python -m bench.bench_config_load [menus] [buttons per menu]
+import sys
+import time
+
+from bench.common import bench_env, bench_cleanup, BENCH_USER, BENCH_SESSION
+
+def generate(menus: int, buttons: int) -> dict:
+    return {'connect': [{'api_id': 1, 'api_hash': 'hash', 'session': BENCH_SESSION, 'token': 'token'}],
+            'users': [{'name': f'{BENCH_USER}_{i}', 'auto_msg': i % 2 == 0} for i in range(100)],
+            'menu': [{'text': f'menu_{m}',
+                      'buttons': [{'text': f'button_{b}', 'slot_type': 'menu', 'slot_uid': f'menu_{(m + b) % menus}', 'params': {'n': b}}
+                                  for b in range(buttons)]} for m in range(menus)],
+            'text_command': [{'text': f'/cmd_{m}', 'slot_type': 'menu', 'slot_uid': f'menu_{m}'} for m in range(menus)],
+            'auto': [{'plugin_uid': 'plugin', 'params': {}} for _ in range(10)]}
+
+def load_per_record(db, data: dict) -> None:
+    from module.core_class import TgConnect, TgUser, TgMenu, TgTextCmd, TgAuto
+    for conn in data['connect']:
+        db.add_connect(TgConnect().from_dict(conn))
+    for user in data['users']:
+        db.add_user(TgUser().from_dict(user))
+    for menu in data['menu']:
+        db.add_menu(TgMenu().from_dict(menu))
+    for txt_cmd in data['text_command']:
+        db.add_text_cmd(TgTextCmd().from_dict(txt_cmd))
+    for auto in data['auto']:
+        db.add_tg_auto(TgAuto().from_dict(auto))
+
+def main(menus: int = 1000, buttons: int = 10) -> None:
+    path = bench_env()
+    try:
+        from module.core_db_config import CoreDbConfig
+        data = generate(menus, buttons)
+        print(f'{menus} menus x {buttons} buttons, {menus} text commands, 100 users')
+
+        db = CoreDbConfig(reset=True)
+        start = time.perf_counter()
+        load_per_record(db, data)
+        print(f'{"per record add_*":<20} {time.perf_counter() - start:>8.3f} s')
+
+        db = CoreDbConfig(reset=True)
+        start = time.perf_counter()
+        timing = db.load_config(data)
+        print(f'{"load_config":<20} {time.perf_counter() - start:>8.3f} s  ' +
+              ' '.join(f'{k}={v * 1000:.1f}ms' for k, v in timing.items()))
+    finally:
+        bench_cleanup(path)
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:3]])
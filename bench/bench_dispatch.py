@@ -0,0 +1,73 @@
+# p50/p99 latency of concurrent clicks: inline Core.user_request vs CoreDispatch
+# Run from the repo root: python -m bench.bench_dispatch [clicks]
+import sys
+import time
+import asyncio
+
+from bench.common import bench_env, bench_cleanup, plugin_src, report, BENCH_USER, BENCH_SESSION
+
+PLUGIN_DELAY = 0.05
+
+def build_core():
+    from module.core import Core
+    from module.core_db_config import CoreDbConfig
+    from module.core_class import TgConnect, TgUser, TgMenu, TgTextCmd
+    db = CoreDbConfig(reset=True)
+    db.add_connect(TgConnect(api_id=1, api_hash='hash', session=BENCH_SESSION, token='token'))
+    db.add_user(TgUser(name=BENCH_USER, auto_msg=True))
+    db.add_menu(TgMenu().from_dict({'text': 'Main', 'buttons': [
+        {'text': 'Sync', 'slot_type': 'plugin', 'slot_uid': 'bench_sync'},
+        {'text': 'Async', 'slot_type': 'plugin', 'slot_uid': 'bench_async'},
+        {'text': 'Main', 'slot_type': 'menu', 'slot_uid': 'Main'}]}))
+    for text, slot_type, slot_uid in (('/start', 'menu', 'Main'), ('sync', 'plugin', 'bench_sync'), ('async', 'plugin', 'bench_async')):
+        db.add_text_cmd(TgTextCmd().from_dict({'text': text, 'slot_type': slot_type, 'slot_uid': slot_uid}))
+    return Core()
+
+def requests(clicks: int, cmd: str) -> list:
+    from module.core_class import Request, SignalType
+    # Every third click is a plugin, the rest is menu navigation
+    return [Request(type=SignalType.text_cmd, chat_id=i, msg_id=i, username=BENCH_USER,
+                    data=cmd if i % 3 == 0 else '/start') for i in range(clicks)]
+
+async def run_clicks(handler, reqs: list) -> tuple[dict, float]:
+    latency = {'menu': [], 'plugin': []}
+    async def click(req):
+        start = time.perf_counter()
+        await handler(req)
+        latency['menu' if req.data == '/start' else 'plugin'].append(time.perf_counter() - start)
+    start = time.perf_counter()
+    await asyncio.gather(*[click(r) for r in reqs])
+    return latency, time.perf_counter() - start
+
+def main(clicks: int = 300) -> None:
+    path = bench_env({'bench_sync': plugin_src('bench_sync', f'time.sleep({PLUGIN_DELAY})'),
+                      'bench_async': plugin_src('bench_async', f'await asyncio.sleep({PLUGIN_DELAY})', is_async=True)})
+    try:
+        core = build_core()
+        from module.core_dispatch import CoreDispatch
+
+        async def inline(req):
+            # Baseline: the old core_request, sync call on the loop
+            await asyncio.sleep(0)
+            return core.user_request(req)
+
+        cases = [('inline sync', inline, 'sync')]
+        dispatchers = []
+        for mode in ('thread', 'process'):
+            dispatch = CoreDispatch(core, mode=mode, workers=8)
+            dispatchers.append(dispatch)
+            cases.append((f'{mode} sync', dispatch.user_request, 'sync'))
+        cases.append(('loop async', dispatchers[0].user_request, 'async'))
+
+        print(f'{clicks} concurrent clicks, plugin delay {PLUGIN_DELAY * 1000:.0f}ms, 1/3 plugin 2/3 menu')
+        for name, handler, cmd in cases:
+            latency, elapsed = asyncio.run(run_clicks(handler, requests(clicks, cmd)))
+            print(report(f'{name} / menu', latency['menu'], elapsed))
+            print(report(f'{name} / plugin', latency['plugin'], elapsed))
+        for dispatch in dispatchers:
+            dispatch.shutdown()
+    finally:
+        bench_cleanup(path)
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:2]])
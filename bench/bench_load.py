@@ -0,0 +1,161 @@
+# Load test of tg_cmd_bot.py against a fake Telegram client: throughput, p50/p99 latency, memory
+# Run from the repo root: python -m bench.bench_load [--rate 200] [--seconds 10] [--users 50] [--sessions 1] [--queue-workers N] [--traffic file.jsonl]
+# Traffic file: one JSON object per line {"user": ..., "type": "text_cmd" | "button", "data": ...},
+# a button data may be a menu text, it is replaced by the data of that menu's first button
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import resource
+import tracemalloc
+
+from bench.common import bench_env, bench_cleanup, plugin_src, report, BENCH_USER, BENCH_SESSION
+
+PLUGIN_DELAY = 0.01
+
+def generate_config(users: int, sessions: int = 1) -> dict:
+    return {'connect': [{'api_id': 1, 'api_hash': 'hash', 'session': BENCH_SESSION if n == 0 else f'{BENCH_SESSION}_{n}', 'token': f'token_{n}'}
+                        for n in range(sessions)],
+            'users': [{'name': f'{BENCH_USER}_{i}', 'auto_msg': i % 5 == 0} for i in range(users)],
+            'menu': [{'text': 'Main', 'buttons': [
+                        {'text': 'Sync', 'slot_type': 'plugin', 'slot_uid': 'bench_sync'},
+                        {'text': 'Async', 'slot_type': 'plugin', 'slot_uid': 'bench_async'},
+                        {'text': 'Sub', 'slot_type': 'menu', 'slot_uid': 'Sub'}]},
+                     {'text': 'Sub', 'buttons': [
+                        {'text': 'Main', 'slot_type': 'menu', 'slot_uid': 'Main'}]}],
+            'text_command': [{'text': '/start', 'slot_type': 'menu', 'slot_uid': 'Main'},
+                             {'text': 'sync', 'slot_type': 'plugin', 'slot_uid': 'bench_sync'},
+                             {'text': 'async', 'slot_type': 'plugin', 'slot_uid': 'bench_async'}],
+            'auto': [{'plugin_uid': 'bench_async', 'schedule': '1s'}]}
+
+def synthetic_traffic(count: int, users: int, buttons: list) -> list:
+    # Half text commands (mostly menus), half button clicks
+    rnd = random.Random(1)
+    result = []
+    for i in range(count):
+        user = f'{BENCH_USER}_{rnd.randrange(users)}'
+        if i % 2 == 0:
+            result.append({'user': user, 'type': 'text_cmd', 'data': rnd.choice(['/start', '/start', 'sync', 'async'])})
+        else:
+            result.append({'user': user, 'type': 'button', 'data': rnd.choice(buttons)})
+    return result
+
+def read_traffic(path: str, snapshot) -> list:
+    result = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                rec = json.loads(line)
+                if rec.get('type') == 'button' and rec['data'] in snapshot.menus:
+                    rec['data'] = snapshot.menus[rec['data']].get_all_buttons()[0].data
+                result.append(rec)
+    return result
+
+async def replay(bot, fake, traffic: list, rate: float) -> tuple[dict, float]:
+    # Open loop: request i arrives at start + i / rate whether or not the bot keeps up,
+    # latency is counted from the arrival time. Requests go round-robin to the bot sessions
+    latency = {'text_cmd': [], 'button': []}
+    clients = list(bot.clients.values())
+    async def one(n: int, rec: dict, arrival: float):
+        client = clients[n % len(clients)]
+        if rec['type'] == 'button':
+            done = await bot.handle_new_data(fake.callback_event(rec['user'], n, n, rec['data'], client))
+        else:
+            done = await bot.handle_new_message(fake.message_event(rec['user'], n, n, rec['data'], client))
+        # Queued: the handler returns at once, the request is done when a worker has sent the reply
+        if done is not None:
+            await done
+        latency[rec['type']].append(time.perf_counter() - arrival)
+    tasks = []
+    start = time.perf_counter()
+    for n, rec in enumerate(traffic):
+        arrival = start + n / rate
+        delay = arrival - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(n, rec, arrival)))
+    await asyncio.gather(*tasks)
+    return latency, time.perf_counter() - start
+
+async def run(bot, fake, traffic: list, rate: float) -> tuple[dict, float]:
+    # User traffic with the auto messages (every second) sent alongside
+    system = asyncio.create_task(bot.handle_system_message())
+    if bot.queue_workers > 0:
+        await bot.inbound.start(bot.queued_request)
+    latency, elapsed = await replay(bot, fake, traffic, rate)
+    system.cancel()
+    await bot.inbound.stop()
+    return latency, elapsed
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(prog='bench_load')
+    parser.add_argument('--rate', type=float, default=200, help='requests per second')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--sessions', type=int, default=1, help='bot sessions served by the process')
+    parser.add_argument('--net-ms', type=float, default=5, help='fake Telegram latency per send/edit')
+    parser.add_argument('--queue-workers', type=int, default=None, help='inbound queue workers, 0 - handle requests inline')
+    parser.add_argument('--traffic', default=None, help='JSON lines to replay instead of synthetic traffic')
+    args = parser.parse_args(argv)
+
+    path = bench_env({'bench_sync': plugin_src('bench_sync', f'time.sleep({PLUGIN_DELAY})'),
+                      'bench_async': plugin_src('bench_async', f'await asyncio.sleep({PLUGIN_DELAY})', is_async=True)})
+    import module.config as config
+    config.log_path = path
+    config.print_log = False
+    config.plugin_watch = 0
+    config.config_watch = 0
+    # The bench users click far more often than real ones, the limiter must not hide the bot
+    config.user_rate = 1000
+    config.user_burst = 1000
+    config.max_inflight = 100000
+    # Same for the per session Telegram send rate, the fake client has no flood limits
+    config.send_rate = 100000
+    config.sessions = ['*']
+    config.queue_path = os.path.join(path, 'queue.sqlite3')
+    if args.queue_workers is not None:
+        config.queue_workers = args.queue_workers
+    try:
+        from module.core_db_config import CoreDbConfig
+        db = CoreDbConfig(reset=True)
+        db.load_config(generate_config(args.users, args.sessions))
+        db.bump_version()
+
+        from bench import fake_telegram as fake
+        fake.install()
+        fake.FakeClient.latency = args.net_ms / 1000
+        tracemalloc.start()
+        start = time.perf_counter()
+        import tg_cmd_bot as bot
+        startup = time.perf_counter() - start
+
+        snapshot = bot.core.config.snapshot
+        if args.traffic is not None:
+            traffic = read_traffic(args.traffic, snapshot)
+        else:
+            traffic = synthetic_traffic(int(args.rate * args.seconds), args.users, list(snapshot.buttons.keys()))
+
+        print(f'{len(traffic)} requests at {args.rate:.0f}/s, {args.users} users, {len(bot.clients)} sessions, fake network {args.net_ms:.0f}ms, '
+              f'plugin delay {PLUGIN_DELAY * 1000:.0f}ms, startup {startup * 1000:.0f}ms')
+        latency, elapsed = asyncio.run(run(bot, fake, traffic, args.rate))
+        for kind, values in latency.items():
+            print(report(kind, values, elapsed))
+        print(report('all', latency['text_cmd'] + latency['button'], elapsed))
+        current, peak = tracemalloc.get_traced_memory()
+        for name, client in bot.clients.items():
+            # Replies go to numeric chat ids, auto messages to user names
+            auto = sum(n for chat, n in client.chats.items() if isinstance(chat, str))
+            print(f'{name}: sent={client.sent} edited={client.edited} auto={auto}')
+        print(f'limiter: {bot.limiter}')
+        print(f'queue: {bot.inbound}')
+        print(f'memory: python peak={peak / 2**20:.1f}MB now={current / 2**20:.1f}MB '
+              f'max rss={resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f}MB')
+        bot.dispatch.shutdown()
+    finally:
+        bench_cleanup(path)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,50 @@
+# Startup phases of Core on a generated config: plugin catalog, snapshot read, integrity check
+# Run from the repo root: python -m bench.bench_startup [menus] [buttons per menu] [plugins]
+import sys
+import time
+
+from bench.common import bench_env, bench_cleanup, plugin_src
+from bench.bench_config_load import generate
+
+def main(menus: int = 1000, buttons: int = 10, plugins: int = 50) -> None:
+    path = bench_env({f'plugin_{i}': plugin_src(f'plugin_{i}') for i in range(plugins)})
+    try:
+        from module.core_db_config import CoreDbConfig
+        from module.core_plugin import CorePlugin
+        from module.core_check import check_config
+        from module.core import Core
+        import module.config as config
+
+        data = generate(menus, buttons)
+        data['auto'] = [{'plugin_uid': f'plugin_{i}', 'params': {}} for i in range(plugins)]
+        CoreDbConfig(reset=True).load_config(data)
+        print(f'{menus} menus x {buttons} buttons, {plugins} plugins')
+
+        phases = []
+        start = time.perf_counter()
+        db = CoreDbConfig(reset=False)
+        phases.append(('open db', time.perf_counter() - start))
+        start = time.perf_counter()
+        pl = CorePlugin()
+        phases.append(('plugin catalog', time.perf_counter() - start))
+        start = time.perf_counter()
+        snapshot = db.reload()
+        phases.append(('snapshot read', time.perf_counter() - start))
+        start = time.perf_counter()
+        report = check_config(snapshot, pl.plugins(), config.session)
+        phases.append(('integrity check', time.perf_counter() - start))
+        for name, sec in phases:
+            print(f'{name:<20} {sec * 1000:>9.1f} ms')
+        print(f'{"errors / warnings":<20} {len(report.errors)} / {len(report.warnings)}, loops {len(report.cycles)}')
+
+        db.bump_version()
+        for name in ('Core() cold', 'Core() cached'):
+            start = time.perf_counter()
+            core = Core()
+            print(f'{name:<20} {(time.perf_counter() - start) * 1000:>9.1f} ms  ' +
+                  ' '.join(f'{k}={v * 1000:.1f}ms' for k, v in core.timing.items()))
+    finally:
+        bench_cleanup(path)
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:4]])
@@ -0,0 +1,65 @@
+# Shared helpers for the benchmarks: a throwaway config DB and plugin folder
+import os
+import sys
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import module.config as config
+
+BENCH_USER = 'bench_user'
+BENCH_SESSION = 'bench_session'
+
+def bench_env(plugins: dict = {}) -> str:
+    # Point module.config at a temp dir, must run before any other module.* import
+    path = tempfile.mkdtemp(prefix='tg_cmd_bot_bench_')
+    plugin_dir = os.path.join(path, 'plugins')
+    os.mkdir(plugin_dir)
+    for name, src in plugins.items():
+        with open(os.path.join(plugin_dir, f'{name}.py'), 'w', encoding='utf-8') as f:
+            f.write(src)
+    # BENCH_DB=postgresql+psycopg://... runs the benchmark on another database
+    config.db_conn_str = os.environ.get('BENCH_DB', f'''sqlite:///{os.path.join(path, 'bench.sqlite3')}''')
+    config.plugin_path = plugin_dir
+    config.session = BENCH_SESSION
+    config.startup_cache = os.path.join(path, 'startup_cache.pickle')
+    config.state_path = os.path.join(path, 'chat_state.pickle')
+    return path
+
+def bench_cleanup(path: str) -> None:
+    shutil.rmtree(path, ignore_errors=True)
+
+def plugin_src(uid: str, body: str = 'pass', is_async: bool = False) -> str:
+    return f'''from module.core_class import Reply, ReplyType
+import time
+import asyncio
+
+uid = '{uid}'
+
+class Plugin():
+    def __init__(self, args: list = [], params: dict = None) -> None:
+        self.params = params
+
+    @staticmethod
+    def get_uid() -> str:
+        return uid
+
+    @staticmethod
+    def get_info() -> str:
+        return uid
+
+    {'async ' if is_async else ''}def run(self) -> Reply:
+        {body}
+        return Reply(type=ReplyType.message, text='', data=[f'Plugin <{{uid}}> msg.'])
+'''
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def report(name: str, latencies: list, elapsed: float) -> str:
+    return (f'{name:<28} n={len(latencies):<6} rps={len(latencies) / elapsed:>9.1f} '
+            f'p50={percentile(latencies, 50) * 1000:>8.2f}ms p99={percentile(latencies, 99) * 1000:>8.2f}ms')
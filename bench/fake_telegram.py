@@ -0,0 +1,98 @@
+# In-process stand-in for the parts of Telethon tg_cmd_bot.py uses.
+# install() must run before tg_cmd_bot is imported; sent and edited messages are counted, not delivered
+import sys
+import asyncio
+from types import ModuleType, SimpleNamespace
+
+class FloodWaitError(Exception):
+    def __init__(self, seconds: int = 0) -> None:
+        super().__init__(f'A wait of {seconds} seconds is required')
+        self.seconds = seconds
+
+class MessageNotModifiedError(Exception):
+    pass
+
+class Button():
+    @staticmethod
+    def inline(text: str, data) -> tuple:
+        return (text, data)
+
+class NewMessage():
+    def __init__(self, func=None) -> None:
+        self.func = func
+
+class CallbackQuery():
+    def __init__(self, func=None) -> None:
+        self.func = func
+
+class FakeClient():
+    # Network latency of every send/edit in seconds
+    latency = 0.0
+
+    def __init__(self, session=None, api_id=None, api_hash=None) -> None:
+        self.session = session
+        self.handlers = []
+        self.sent = 0
+        self.edited = 0
+        # chat -> messages sent
+        self.chats = {}
+        self.next_id = 0
+
+    def start(self, bot_token: str = None):
+        return self
+
+    def on(self, event):
+        def wrap(func):
+            self.handlers.append((event, func))
+            return func
+        return wrap
+
+    def build_reply_markup(self, buttons):
+        return buttons
+
+    async def send_message(self, chat, text, buttons=None):
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        self.sent += 1
+        self.next_id += 1
+        self.chats[chat] = self.chats.get(chat, 0) + 1
+        return SimpleNamespace(id=self.next_id)
+
+    async def edit_message(self, chat, msg_id, text, buttons=None):
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        self.edited += 1
+        return SimpleNamespace(id=msg_id)
+
+    async def run_until_disconnected(self):
+        await asyncio.Event().wait()
+
+def message_event(user: str, chat_id: int, msg_id: int, text: str, client: FakeClient = None):
+    sender = SimpleNamespace(username=user)
+    async def get_sender():
+        return sender
+    message = SimpleNamespace(chat=SimpleNamespace(id=chat_id), id=msg_id, message=text)
+    return SimpleNamespace(get_sender=get_sender, message=message, is_private=True, client=client)
+
+def callback_event(user: str, chat_id: int, msg_id: int, data: str, client: FakeClient = None):
+    sender = SimpleNamespace(username=user)
+    async def get_sender():
+        return sender
+    return SimpleNamespace(get_sender=get_sender, chat=SimpleNamespace(id=chat_id), message_id=msg_id, data=data.encode('utf-8'), client=client)
+
+def install() -> None:
+    telethon = ModuleType('telethon')
+    telethon.TelegramClient = FakeClient
+    telethon.Button = Button
+    telethon.events = ModuleType('telethon.events')
+    telethon.events.NewMessage = NewMessage
+    telethon.events.CallbackQuery = CallbackQuery
+    telethon.errors = ModuleType('telethon.errors')
+    telethon.errors.FloodWaitError = FloodWaitError
+    telethon.errors.MessageNotModifiedError = MessageNotModifiedError
+    telethon.tl = ModuleType('telethon.tl')
+    telethon.tl.patched = ModuleType('telethon.tl.patched')
+    telethon.tl.patched.Message = SimpleNamespace
+    for name, module in (('telethon', telethon), ('telethon.events', telethon.events), ('telethon.errors', telethon.errors),
+                         ('telethon.tl', telethon.tl), ('telethon.tl.patched', telethon.tl.patched)):
+        sys.modules[name] = module
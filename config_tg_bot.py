@@ -1,23 +1,16 @@
 import os
 import json
-import logging
+import argparse
 
 from module.core_db_config import CoreDbConfig
-from module.core_class import TgConnect, TgUser, TgMenu, TgButton, TgTextCmd, SlotType, TgAuto
-from module.config import db_conn_str
+from module.core_log import get_logger
 from module.core_exception import CoreException
 
 log_path = os.path.join('.', 'logs')
 config_path = os.path.join('.', 'load_config', 'config.json')
 
 
-py_logger = logging.getLogger(__name__)
-py_logger.setLevel(logging.INFO)
-py_handler = logging.FileHandler(os.path.join(log_path, 'config_bot.log'), mode='a')
-py_formatter = logging.Formatter("%(asctime)s %(levelname)s %(message)s")
-py_handler.setFormatter(py_formatter)
-py_logger.addHandler(py_handler)
-py_logger.addHandler(logging.StreamHandler())
+py_logger = get_logger(__name__, os.path.join(log_path, 'config_bot.log'))
 
 def read_json(path: str) -> dict:
     try:
@@ -30,28 +23,34 @@ def read_json(path: str) -> dict:
         raise CoreException(f'''File not json format {path}''')
 
 
-def main() -> None:
+def main(sync: bool = False) -> None:
     try:
         data = read_json(config_path)
-        config = CoreDbConfig(reset=True)
-        for conn in data['connect']:
-            config.add_connect(TgConnect().from_dict(conn))
-        for user in data['users']:
-            config.add_user(TgUser().from_dict(user))
-        for menu in data['menu']:
-            config.add_menu(TgMenu().from_dict(menu))
-        for txt_cmd in data['text_command']:
-            config.add_text_cmd(TgTextCmd().from_dict(txt_cmd))
-        for auto in data['auto']:
-            config.add_tg_auto(TgAuto().from_dict(auto))
-
-        # Check Config
-        if  not config.check_errors_integrity():
-            py_logger.error('=== Configuration errors ===')
+        if sync:
+            # Apply only the changes, button uids of existing buttons stay the same
+            config = CoreDbConfig(reset=False)
+            for section, (ins, upd, dlt) in config.sync_config(data).items():
+                py_logger.info(f'''Sync <{section}>: inserted {ins}, updated {upd}, deleted {dlt}''')
+            # Checked before the commit, on errors the DB keeps the previous config
+            ok = config.report.ok()
+        else:
+            config = CoreDbConfig(reset=True)
+            for section, sec in config.load_config(data).items():
+                py_logger.info(f'''Load <{section}>: {sec * 1000:.1f} ms''')
+            # Check Config
+            ok = config.check_errors_integrity()
+
+        for w in config.report.warnings:
+            py_logger.warning(w)
+        for cycle in config.report.cycles:
+            py_logger.info(f'''Menu loop: {' -> '.join(cycle)}''')
+        if  not ok:
+            py_logger.error('=== Configuration errors ===' + (' (not applied)' if sync else ''))
             for e in config.get_errors():
                 py_logger.error(e)
             exit(10)
         else:
+            config.bump_version()
             py_logger.info(f'''Load config <{config_path}> OK''')
     except CoreException as e:
         py_logger.error(f'{e.msg}')
@@ -59,5 +58,8 @@ def main() -> None:
             py_logger.error(f'  {s}')
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Load the json config into the bot DB')
+    parser.add_argument('--sync', dest='sync', action='store_true', required=False,
+                        help='apply only the changes instead of recreating the DB, running bots reload it')
+    main(parser.parse_args().sync)
 
@@ -2,8 +2,93 @@ import os
 
 print_log = True
 sleep_sys_msg = 300
+# Max random delay (s) added to every auto task run
+auto_jitter = 5
 log_path = os.path.join('.', 'logs')
 
 db_conn_str= f'''sqlite:///{os.path.join('.', 'db', 'tg_bot_db_demo.sqlite3')}'''
 session = 'tg_cmd_bot'
-plugin_path = os.path.join('.', 'plugins')
\ No newline at end of file
+# Validated config and plugin catalog for a fast start, None - disabled
+startup_cache = os.path.join('.', 'db', 'startup_cache.pickle')
+plugin_path = os.path.join('.', 'plugins')
+# Plugin hot-reload poll interval in seconds, 0 - disabled
+plugin_watch = 10
+# Config DB change poll interval in seconds, 0 - disabled
+config_watch = 10
+# Plugin execution: 'thread' or 'process' pool for sync plugins, async plugins run on the loop
+dispatch_mode = 'thread'
+dispatch_workers = 4
+# Default per plugin limits, overridden by Plugin.concurrency / Plugin.timeout
+plugin_limit = 2
+plugin_timeout = 60
+# Auto message fan-out: parallel sends, global and per chat messages per second
+send_concurrency = 8
+send_rate = 25
+send_chat_rate = 1
+send_chat_burst = 3
+send_retries = 2
+# Longest flood wait (s) to sit out inside a cycle, longer waits skip the chat
+send_max_wait = 60
+# Incoming requests: per user requests per second and burst, max requests in progress
+user_rate = 1
+user_burst = 5
+max_inflight = 50
+overload_msg = 'The bot is busy, try again later'
+# Cached replies of plugins with Plugin.cache_ttl, 0 - disabled
+result_cache_size = 256
+# Users allowed to run the bot service commands (/cache ...)
+admin_users = []
+# Latency histograms and gauges, served as Prometheus text on host:port (port 0 - no HTTP)
+metrics_enabled = False
+metrics_host = '127.0.0.1'
+metrics_port = 9108
+# Logs: 'text' or 'json' lines, rotation by 'size' (log_max_bytes) or 'time' (log_when),
+# records beyond log_queue_size waiting for the writer thread are dropped
+log_format = 'text'
+log_rotate = 'size'
+log_max_bytes = 10 * 1024 * 1024
+log_when = 'midnight'
+log_backups = 5
+log_queue_size = 10000
+# Sandbox: warm worker processes with per call limits (0 - unlimited) for plugins with
+# Plugin.sandbox = True, the uids in sandbox_plugins, or every sync plugin with dispatch_mode = 'sandbox'.
+# Workers are replaced after sandbox_max_calls calls; sandbox_start: None - platform default, 'fork', 'spawn'
+sandbox_workers = 2
+sandbox_max_calls = 100
+sandbox_cpu_limit = 10
+sandbox_memory_limit = 512
+sandbox_plugins = []
+sandbox_start = None
+# More bot sessions (tg_connect rows) served by this process with the same config and plugins,
+# ['*'] - every connect. Auto messages are sent by the main session only
+sessions = []
+# DB connection pool (also the number of DB threads without an async engine),
+# SQLite WAL journal and lock wait in ms
+db_pool_size = 5
+db_max_overflow = 5
+db_wal = True
+db_busy_timeout = 5000
+# Async engine for the bot's DB calls, e.g. 'sqlite+aiosqlite:///...' or 'postgresql+asyncpg://...',
+# None - the sync engine in a thread pool
+db_async_conn_str = None
+# Inbound queue between the Telegram handlers and the Core: workers (queue_reserved of them
+# for buttons and menus only), queued requests before the bot answers overload_msg, SQLite file
+# for the replay of unfinished requests after a crash (None - memory only) and the oldest
+# request (s) worth replaying. queue_workers = 0 - no queue
+queue_workers = 32
+queue_reserved = 4
+queue_busy_depth = 500
+queue_path = os.path.join('.', 'db', 'tg_bot_queue.sqlite3')
+queue_replay_age = 300
+# Per chat navigation state: idle time (s) before a chat is forgotten (0 - never), max chats
+# kept, snapshot file written every state_save s and on exit (None - memory only)
+state_ttl = 24 * 3600
+state_size = 50000
+state_path = os.path.join('.', 'db', 'chat_state.pickle')
+state_save = 300
+# Menus: buttons per page (0 - one page) and per row, unless the menu sets page_size / columns;
+# labels of the page buttons, {page} - the page they open, {pages} - the number of pages
+menu_page_size = 20
+menu_columns = 1
+menu_prev_text = '« {page}/{pages}'
+menu_next_text = '{page}/{pages} »'
\ No newline at end of file
@@ -1,59 +1,268 @@
-from module.core_class import TgConnect, Request, Reply, ReplyType, SignalType, SlotType
-from module.core_db_config import CoreDbConfig
+import time
+
+from module.core_class import TgConnect, Request, Reply, ReplyType, SignalType, SlotType, PluginCall, ConfigSnapshot
+from module.core_config import CoreConfig
 from module.core_plugin import CorePlugin
+from module.core_check import check_config
+from module.core_cache import load_cache, save_cache
+from module.core_result import CoreResultCache
+from module.core_state import CoreState
+from module.core_metrics import metrics
 from module.core_exception import CoreException
 
+from module.config import session, admin_users, menu_page_size, menu_columns, menu_prev_text, menu_next_text
+
+# Callback data of the page buttons: PAGE_DATA + tg_menu.id + '.' + page, never a button data (A-Z, 0-9)
+PAGE_DATA = '~'
+
 class Core():
-    def __init__(self):
-        self.db = CoreDbConfig(reset=False)
-        self.pl = CorePlugin()
-        self.last_menu = None
-        if not self.db.check_errors_integrity():
-            raise CoreException(msg='Check errors integrity', data=self.db.get_errors())
+    def __init__(self, on_connect = None):
+        # on_connect(TgConnect) is called as soon as the connect settings are known,
+        # so the caller can connect to Telegram while the plugins are checked
+        self.timing = {}
+        self.db_config = None
+        self.async_db = None
+        # chat_id -> ChatState: current menu and message, plugin scratch data
+        self.states = CoreState()
+        # (menu text, page) -> (menu text, (((button text, button data), ...), ...)), a tuple per row
+        self.menu_cache = {}
+        self.results = CoreResultCache()
+        # Service commands of the admin users, checked before the configured commands
+        self.service = {'/CACHE': self.__cmd_cache__, '/METRICS': self.__cmd_metrics__}
+        cache = self.__phase__('cache', load_cache)
+        if cache is not None:
+            # Cache hit: no SQLAlchemy import, plugins are imported on first use
+            snapshot = cache['snapshot']
+            if on_connect is not None:
+                on_connect(CoreConfig(snapshot).get_connect())
+            self.pl = self.__phase__('plugins', CorePlugin, cache['catalog'])
+            if self.pl.catalog() == cache['catalog']:
+                self.warnings = cache['warnings']
+            else:
+                report = self.__phase__('check', check_config, snapshot, self.pl.plugins(), session)
+                report.warnings[:0] = self.pl.errors
+                if not report.ok():
+                    raise CoreException(msg='Check errors integrity', data=report.errors)
+                self.warnings = report.warnings
+                save_cache(snapshot, self.pl.catalog(), self.warnings)
+        else:
+            self.__phase__('db', self.__open_db__)
+            snapshot = self.__phase__('snapshot', self.db.reload)
+            if on_connect is not None and session in snapshot.connects:
+                on_connect(snapshot.connects[session])
+            self.pl = self.__phase__('plugins', CorePlugin)
+            if not self.__phase__('check', self.db.check_errors_integrity, self.pl, snapshot):
+                raise CoreException(msg='Check errors integrity', data=self.db.get_errors())
+            self.warnings = self.db.report.warnings
+            save_cache(snapshot, self.pl.catalog(), self.warnings)
+        self.__phase__('state', self.states.load)
+        self.config = CoreConfig(snapshot)
+        self.version = snapshot.version
+
+    def __phase__(self, name: str, func, *args):
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.timing[name] = time.perf_counter() - start
+
+    @property
+    def db(self):
+        return self.__open_db__()
+
+    def __open_db__(self):
+        # The config DB (and SQLAlchemy) is opened on first use
+        if self.db_config is None:
+            from module.core_db_config import CoreDbConfig
+            self.db_config = CoreDbConfig(reset=False)
+        return self.db_config
+
+    @property
+    def adb(self):
+        # Awaitable DB access for code running on the event loop
+        if self.async_db is None:
+            from module.core_storage import CoreAsyncDb
+            self.async_db = CoreAsyncDb(self.db)
+        return self.async_db
+
+    def reload(self) -> bool:
+        # Pick up config changes without a restart, a broken config keeps the old snapshot
+        snapshot = self.read_config()
+        if snapshot is None:
+            return False
+        self.apply_config(snapshot)
+        return True
+
+    def read_config(self) -> ConfigSnapshot:
+        # The DB part of reload(), for an executor: the checked snapshot, None for a broken config
+        self.version = self.db.get_version()
+        if not self.db.check_errors_integrity(self.pl):
+            return None
+        snapshot = self.db.reload(self.db.checked)
+        save_cache(snapshot, self.pl.catalog(), self.db.report.warnings)
+        return snapshot
+
+    def apply_config(self, snapshot: ConfigSnapshot) -> None:
+        # The swap part of reload(), on the thread that serves the requests,
+        # so no menu page of the old config lands in the new cache
+        self.warnings = self.db.report.warnings
+        self.config = CoreConfig(snapshot)
+        self.menu_cache = {}
+        self.results.purge()
 
     def get_tg_connect(self) -> TgConnect:
-        return self.db.get_connect()
+        return self.config.get_connect()
+
+    def get_tg_connects(self, sessions: list[str]) -> list[TgConnect]:
+        return self.config.get_all_connect(sessions)
 
     def get_auto_users(self) -> list[str]:
-        return self.db.get_auto_users()
+        return self.config.get_auto_users()
 
     def user_request(self, request: Request) -> list[Reply]:
-        if not self.db.check_user(request.username):
+        with metrics.timer('core', self.command_label(request)):
+            result = self.route(request)
+            if isinstance(result, PluginCall):
+                return self.get_reply_plugin(result.uid, result.args, result.params)
+            return result
+
+    def command_label(self, request: Request) -> str:
+        # Metrics label: the configured command or button, anything else is '?'
+        word = str(request.data.split(' ')[0]).upper()
+        if request.type == SignalType.button and word.startswith(PAGE_DATA):
+            # All page buttons share one label
+            word, known = PAGE_DATA, True
+        elif request.type == SignalType.text_cmd:
+            known = word in self.service or self.config.get_text_cmd(word) is not None
+        else:
+            known = self.config.get_button(word) is not None
+        return f'{request.type.name}:{word if known else "?"}'
+
+    def request_lane(self, request: Request) -> int:
+        # Inbound queue lane: 1 - text commands running a plugin, 0 - buttons and
+        # everything else answered from the config, which must not wait behind them
+        if request.type != SignalType.text_cmd:
+            return 0
+        cmd = self.config.get_text_cmd(str(request.data.split(' ')[0]).upper())
+        return 1 if cmd is not None and SlotType.plugin == cmd.slot_type else 0
+
+    def route(self, request: Request) -> Reply | PluginCall:
+        # Resolve a request without running plugins: menu and error replies are final,
+        # plugin slots come back as a PluginCall for the caller to execute
+        if not self.config.check_user(request.username):
             return Reply(type=ReplyType.error, text=None, data=[f'The <{{request.username}}> is prohibited', f'<{request.data}>'])
         else:
             data = request.data.split(' ')
+            service = self.service.get(str(data[0]).upper())
+            if service is not None and request.type == SignalType.text_cmd and request.username in admin_users:
+                return service(data[1:])
             if request.type == SignalType.text_cmd:
                 rwr_flg = False
-                cmd = self.db.get_text_cmd(str(data[0]).upper())
+                cmd = self.config.get_text_cmd(str(data[0]).upper())
             elif request.type == SignalType.button:
                 rwr_flg = True
-                cmd = self.db.get_button(str(data[0]).upper())
+                if data[0].startswith(PAGE_DATA):
+                    return self.__route_page__(request, data[0])
+                cmd = self.config.get_button(str(data[0]).upper())
             if cmd is not None:
                 if SlotType.menu == cmd.slot_type:
+                    self.__set_state__(request, cmd.slot_uid, 0)
                     return self.get_reply_menu(cmd.slot_uid, rwr_flg)
                 elif SlotType.plugin == cmd.slot_type:
-                    return self.get_reply_plugin(cmd.slot_uid, data[1:], cmd.params)
+                    return PluginCall(uid=cmd.slot_uid, args=data[1:], params=cmd.params)
             else:
                 return Reply(type=ReplyType.error,text='Command not found', data=[f'<{request.data}>'])
 
-    def auto_request(self) -> list[Reply]:
-        result = []
-        for cmd in self.db.get_all_tg_auto():
-            reply = self.get_reply_plugin(cmd.plugin_uid, [], cmd.params)
-            if reply is not None:
-                result.append(reply)
-        return result
-
-    def get_reply_menu(self, menu_text: str, rwr_flg: bool) -> Reply:
-        self.last_menu = menu_text
-        tg_menu = self.db.get_menu(menu_text=menu_text)
+    def __route_page__(self, request: Request, data: str) -> Reply:
+        # Page button: the menu and the page are in the callback data, no lookup by button
+        try:
+            menu_id, page = (int(x) for x in data[len(PAGE_DATA):].split('.'))
+        except ValueError:
+            menu_id, page = None, 0
+        tg_menu = self.config.get_menu_by_id(menu_id)
+        if tg_menu is None:
+            return Reply(type=ReplyType.error, text='Command not found', data=[f'<{request.data}>'])
+        # The state gets the page actually shown
+        page = self.menu_page(tg_menu, page)
+        reply = self.get_reply_menu(tg_menu.text, True, page)
+        self.__set_state__(request, tg_menu.text, page)
+        return reply
+
+    def __set_state__(self, request: Request, menu_text: str, page: int) -> None:
+        state = self.states.state(request.chat_id)
+        state.menu = menu_text
+        state.page = page
+        if request.type == SignalType.button:
+            # The clicked message is rewritten in place
+            state.msg_id = request.msg_id
+
+    def get_reply_menu(self, menu_text: str, rwr_flg: bool, page: int = 0) -> Reply:
+        # Only the requested page is built, pages are cached until the next reload
+        tg_menu = self.config.get_menu(menu_text=menu_text)
         if tg_menu is None:
             raise CoreException(f'Configuration error. Menu {menu_text} not found')
-        return Reply(type=ReplyType.menu, text=tg_menu.text, data=[(btn.text, btn.data) for btn in tg_menu.get_all_buttons()], rewrite=rwr_flg)
+        size, columns, pages = self.menu_layout(tg_menu)
+        page = self.menu_page(tg_menu, page)
+        menu = self.menu_cache.get((menu_text, page))
+        if menu is None:
+            menu = (tg_menu.text, self.__menu_rows__(tg_menu, page, size, columns, pages))
+            self.menu_cache[(menu_text, page)] = menu
+        return Reply(type=ReplyType.menu, text=menu[0], data=menu[1], rewrite=rwr_flg)
 
-    def get_reply_plugin(self, uid: str, args: list = [], params: dict = {}) -> Reply:
+    @staticmethod
+    def menu_layout(tg_menu) -> tuple:
+        # (buttons per page, buttons per row, pages)
+        size = menu_page_size if tg_menu.page_size is None else tg_menu.page_size
+        columns = max(1, menu_columns if tg_menu.columns is None else tg_menu.columns)
+        pages = max(1, -(-len(tg_menu.buttons) // size)) if size > 0 else 1
+        return size, columns, pages
+
+    @classmethod
+    def menu_page(cls, tg_menu, page: int) -> int:
+        # A page of an old message may be gone after a reload, the nearest one is shown
+        return min(max(page, 0), cls.menu_layout(tg_menu)[2] - 1)
+
+    def __menu_rows__(self, tg_menu, page: int, size: int, columns: int, pages: int) -> tuple:
+        buttons = [(btn.text, btn.data) for btn in tg_menu.get_page_buttons(page, size)]
+        rows = [tuple(buttons[i:i + columns]) for i in range(0, len(buttons), columns)]
+        if pages > 1:
+            nav = []
+            if page > 0:
+                nav.append((menu_prev_text.format(page=page, pages=pages), f'{PAGE_DATA}{tg_menu.id}.{page - 1}'))
+            if page < pages - 1:
+                nav.append((menu_next_text.format(page=page + 2, pages=pages), f'{PAGE_DATA}{tg_menu.id}.{page + 1}'))
+            rows.append(tuple(nav))
+        return tuple(rows)
+
+    def get_plugin(self, uid: str):
         module = self.pl.load(uid)
         if module is None:
             raise CoreException(f'Configuration error. Module {uid} not found')
-        pl = module.Plugin(args, params)
-        return pl.run()
+        return module.Plugin
+
+    def get_reply_plugin(self, uid: str, args: list = [], params: dict = {}) -> Reply:
+        call = PluginCall(uid=uid, args=args, params=params)
+        cls = self.get_plugin(uid)
+        reply = self.results.get(call, cls)
+        if reply is None:
+            with metrics.timer('plugin', uid):
+                reply = cls(args, params).run()
+            self.results.put(call, cls, reply)
+        return reply
+
+    def run_plugin(self, uid: str, args: list = [], params: dict = {}) -> Reply:
+        # Plugin run without the result cache, for callers that check the cache themselves
+        return self.get_plugin(uid)(args, params).run()
+
+    def __cmd_cache__(self, args: list) -> Reply:
+        # /cache - statistics, /cache purge [plugin uid] - drop cached replies
+        if args and 'PURGE' == args[0].upper():
+            count = self.results.purge(args[1] if len(args) > 1 else None)
+            return Reply(type=ReplyType.message, text='', data=[f'Cache purged: {count} replies'])
+        return Reply(type=ReplyType.message, text='', data=[f'Cache: {self.results}'])
+
+    def __cmd_metrics__(self, args: list) -> Reply:
+        # /metrics [name] - counts and latencies, e.g. /metrics plugin
+        lines = metrics.summary(args[0].lower() if args else None)
+        # Telegram message limit is 4096 characters
+        return Reply(type=ReplyType.message, text='', data=['\n'.join(lines)[:4000] or 'No metrics yet'])
@@ -0,0 +1,53 @@
+# Startup cache: the validated config snapshot and the plugin catalog,
+# valid while the config DB version is the same. Plugin files are checked
+# by CorePlugin against the mtimes stored in the catalog.
+
+import os
+import pickle
+import sqlite3
+from contextlib import closing
+
+from module.core_class import ConfigSnapshot
+
+from module.config import db_conn_str, startup_cache
+
+# Bumped when the pickled classes change, an older cache is ignored
+CACHE_FORMAT = 2
+
+def db_version() -> str:
+    # Config version straight from the SQLite file, without importing SQLAlchemy
+    if not db_conn_str.startswith('sqlite:///'):
+        return None
+    path = db_conn_str[len('sqlite:///'):]
+    if not os.path.isfile(path):
+        return None
+    try:
+        with closing(sqlite3.connect(f'file:{path}?mode=ro', uri=True)) as conn:
+            row = conn.execute("SELECT value FROM tg_meta WHERE key='version'").fetchone()
+            return None if row is None else row[0]
+    except sqlite3.Error:
+        return None
+
+def load_cache() -> dict:
+    if startup_cache is None or not os.path.isfile(startup_cache):
+        return None
+    version = db_version()
+    if version is None:
+        return None
+    try:
+        with open(startup_cache, 'rb') as f:
+            data = pickle.load(f)
+    except Exception:
+        return None
+    if data.get('db') != (db_conn_str, version, CACHE_FORMAT):
+        return None
+    return data
+
+def save_cache(snapshot: ConfigSnapshot, catalog: dict, warnings: list) -> None:
+    if startup_cache is None or snapshot.version is None:
+        return
+    tmp = f'{startup_cache}.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump({'db': (db_conn_str, snapshot.version, CACHE_FORMAT), 'snapshot': snapshot, 'catalog': catalog, 'warnings': warnings},
+                    f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, startup_cache)
@@ -0,0 +1,121 @@
+import time
+from dataclasses import dataclass, field
+
+from module.core_class import ConfigSnapshot, SlotType
+from module.core_scheduler import Schedule
+from module.core_exception import CoreException
+
+from module.config import menu_page_size
+
+# Telegram limits of an inline keyboard
+TG_ROW_BUTTONS = 8
+TG_MENU_BUTTONS = 100
+
+@dataclass
+class IntegrityReport:
+    # errors block the start, warnings and cycles are only reported
+    errors: list = field(default_factory=list)
+    warnings: list = field(default_factory=list)
+    # [[menu, menu, ..., menu], ...] navigation loops
+    cycles: list = field(default_factory=list)
+    # menus reachable from no text command
+    unreachable: list = field(default_factory=list)
+
+    def ok(self) -> bool:
+        return 0 == len(self.errors)
+
+def check_config(snapshot: ConfigSnapshot, plugins: list, session: str) -> IntegrityReport:
+    # All checks in one pass over the in-memory config graph
+    report = IntegrityReport()
+    plugins = set(plugins)
+    if session not in snapshot.connects:
+        report.errors.append(f'Session <{session}> not found')
+    if 0 == len(snapshot.users):
+        report.errors.append(f'Users not found')
+
+    # menu -> menus its buttons open
+    edges = {}
+    for menu in snapshot.menus.values():
+        buttons = menu.get_all_buttons()
+        if 0 == len(buttons):
+            report.errors.append(f'''Menu <{menu.text}> has no buttons''')
+        for name, value, low in (('page_size', menu.page_size, 0), ('columns', menu.columns, 1)):
+            if value is not None and (not isinstance(value, int) or value < low):
+                report.errors.append(f'''Menu <{menu.text}> {name} must be an integer >= {low}''')
+        if menu.columns is not None and isinstance(menu.columns, int) and menu.columns > TG_ROW_BUTTONS:
+            report.errors.append(f'''Menu <{menu.text}> columns: Telegram shows at most {TG_ROW_BUTTONS} buttons in a row''')
+        size = menu_page_size if menu.page_size is None else menu.page_size
+        if isinstance(size, int) and min(len(buttons), size or len(buttons)) > TG_MENU_BUTTONS:
+            report.warnings.append(f'''Menu <{menu.text}> shows more than {TG_MENU_BUTTONS} buttons on a page, the Telegram limit''')
+        targets = edges[menu.text] = []
+        for btn in buttons:
+            if SlotType.menu == btn.slot_type:
+                if btn.slot_uid not in snapshot.menus:
+                    report.errors.append(f'''Button <{btn.text}> in menu <{menu.text}> calls up non-existent menu <{btn.slot_uid}>''')
+                else:
+                    targets.append(btn.slot_uid)
+            elif btn.slot_uid not in plugins:
+                report.errors.append(f'''Button <{btn.text}> in menu <{menu.text}> calls up non-existent plugin <{btn.slot_uid}>''')
+
+    roots = []
+    if 0 == len(snapshot.text_cmds):
+        report.errors.append(f'''Text Command not found''')
+    for cmd in snapshot.text_cmds.values():
+        if SlotType.menu == cmd.slot_type:
+            if cmd.slot_uid not in snapshot.menus:
+                report.errors.append(f'''Text Command <{cmd.text}> calls up non-existent menu <{cmd.slot_uid}>''')
+            else:
+                roots.append(cmd.slot_uid)
+        elif cmd.slot_uid not in plugins:
+            report.errors.append(f'''Text Command <{cmd.text}> calls up non-existent plugin <{cmd.slot_uid}>''')
+
+    for auto in snapshot.auto:
+        if auto.plugin_uid not in plugins:
+            report.errors.append(f'''Auto Command  calls up non-existent plugin <{auto.plugin_uid}>''')
+        if auto.schedule is not None:
+            try:
+                # A valid spec may still never fire, e.g. "0 0 31 2 *"
+                Schedule(auto.schedule).next_run(time.time())
+            except CoreException as e:
+                report.errors.append(f'''Auto Command <{auto.plugin_uid}>: {e.msg}''')
+        if auto.dedup not in (None, 'skip', 'edit'):
+            report.errors.append(f'''Auto Command <{auto.plugin_uid}>: unknown dedup mode <{auto.dedup}>''')
+
+    report.unreachable = __unreachable__(edges, roots)
+    for menu in report.unreachable:
+        report.warnings.append(f'''Menu <{menu}> is not reachable from any text command''')
+    report.cycles = __cycles__(edges)
+    return report
+
+def __unreachable__(edges: dict, roots: list) -> list:
+    seen = set(roots)
+    stack = list(roots)
+    while stack:
+        for target in edges.get(stack.pop(), []):
+            if target not in seen:
+                seen.add(target)
+                stack.append(target)
+    return [menu for menu in edges if menu not in seen]
+
+def __cycles__(edges: dict) -> list:
+    # Iterative DFS, one loop reported per back edge
+    result = []
+    state = {}
+    for start in edges:
+        if start in state:
+            continue
+        path = [start]
+        state[start] = 1
+        iters = [iter(edges[start])]
+        while iters:
+            target = next(iters[-1], None)
+            if target is None:
+                state[path.pop()] = 2
+                iters.pop()
+            elif state.get(target) == 1:
+                result.append(path[path.index(target):] + [target])
+            elif target not in state:
+                state[target] = 1
+                path.append(target)
+                iters.append(iter(edges[target]))
+    return result
@@ -1,11 +1,10 @@
 import enum
 from collections import OrderedDict
+from itertools import islice
 from dataclasses import dataclass
+from types import MappingProxyType
 from typing import Self
 
-from sqlalchemy import  Column, Integer, String, UniqueConstraint, ForeignKey
-from sqlalchemy.orm import DeclarativeBase, relationship
-
 from module.core_exception import CoreException
 
 class ReplyType(enum.Enum):
@@ -26,6 +25,17 @@ class Request:
     username: str
     data: str
 
+@dataclass(slots=True)
+class ChatState:
+    # Navigation of one chat: current menu, id of the bot message showing it,
+    # scratch data of the plugins (uid -> dict) and the last use, time.time()
+    menu: str = None
+    msg_id: int = None
+    data: dict = None
+    touched: float = 0.0
+    # Page of the menu shown
+    page: int = 0
+
 @dataclass
 class Reply:
     type: ReplyType
@@ -33,6 +43,12 @@ class Reply:
     data: list
     rewrite: bool = False
 
+@dataclass
+class PluginCall:
+    uid: str
+    args: list
+    params: dict
+
 class SlotType(enum.Enum):
     menu = 1
     plugin = 2
@@ -104,6 +120,10 @@ class TgMenu:
     text: str = None
     info: str = None
     buttons: OrderedDict = None
+    # Buttons per page and per row, None - the defaults from config
+    page_size: int = None
+    columns: int = None
+    id: int = None
 
     def __post_init__(self):
         self.buttons = OrderedDict()
@@ -114,10 +134,18 @@ class TgMenu:
     def get_all_buttons(self) -> list[TgButton]:
         return list(self.buttons.values())
 
+    def get_page_buttons(self, page: int, page_size: int) -> list[TgButton]:
+        # Only the buttons of one page, page_size 0 - all
+        if page_size <= 0:
+            return self.get_all_buttons()
+        return list(islice(self.buttons.values(), page * page_size, (page + 1) * page_size))
+
     def from_dict(self, data: dict)-> Self:
         try:
             self.text = data['text']
             self.info = self.info = data['info'] if 'info' in data else None
+            self.page_size = data.get('page_size')
+            self.columns = data.get('columns')
             for btn in data['buttons']:
                 self.add_button(TgButton().from_dict(btn))
             return self
@@ -129,70 +157,48 @@ class TgAuto:
     plugin_uid: str = None
     params: dict = None
     info: str = None
+    schedule: str = None
+    # None - send every run, 'skip' - drop unchanged output, 'edit' - edit the previous messages
+    dedup: str = None
+    id: int = None
 
     def from_dict(self, data: dict) -> Self:
         try:
             self.plugin_uid = data['plugin_uid']
             self.params = data['params'] if 'params' in data else {}
             self.info = data['info'] if 'info' in data else None
+            self.schedule = str(data['schedule']) if 'schedule' in data else None
+            self.dedup = data['dedup'] if 'dedup' in data else None
             return self
         except KeyError as k:
             raise CoreException(f'TgUser: KeyError: {k.args[0]}')
 
-class Base(DeclarativeBase): pass
-
-class DbTgConnect(Base):
-    __tablename__ = "tg_connect"
-    id = Column(Integer, primary_key=True, index=True)
-    api_id = Column(Integer, nullable=False)
-    api_hash = Column(String, nullable=False)
-    session = Column(String, nullable=False)
-    token = Column(String, nullable=False)
-    info = Column(String, nullable=True)
-    __table_args__ = (UniqueConstraint("session", name="uniq_session"),)
-
-class DbTgUser(Base):
-    __tablename__ = "tg_users"
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, nullable=False)
-    auto_msg = Column(Integer, nullable=False)
-    info = Column(String, nullable=True)
-    __table_args__ = (UniqueConstraint("name", name="uniq_users"),)
-
-class DbTgMenu(Base):
-    __tablename__ = "tg_menu"
-    id = Column(Integer, primary_key=True, index=True)
-    text = Column(String, nullable=False)
-    info = Column(String, nullable=True)
-    __table_args__ = (UniqueConstraint("text", name="uniq_menu"),)
-
-class DbTgButton(Base):
-    __tablename__ = "tg_buttons"
-    id = Column(Integer, primary_key=True, index=True)
-    menu_id = Column(Integer, ForeignKey(DbTgMenu.id),nullable=False)
-    text = Column(String, nullable=False)
-    data = Column(String, nullable=False)
-    sorting = Column(Integer, nullable=False)
-    slot_type = Column(Integer, nullable=False)
-    slot_uid = Column(String, nullable=False)
-    params = Column(String, nullable=True)
-    info = Column(String, nullable=True)
-    menu = relationship("DbTgMenu", backref='buttons')
-    __table_args__ = (UniqueConstraint("data", name="uniq_btn"), UniqueConstraint("menu_id", "text", name="uniq_menu_btn"),)
-
-class DbTgTextCmd(Base):
-    __tablename__ = "tg_txt_cmd"
-    id = Column(Integer, primary_key=True, index=True)
-    text = Column(String, nullable=False)
-    slot_type = Column(Integer, nullable=False)
-    slot_uid = Column(String, nullable=False)
-    params = Column(String, nullable=True)
-    info = Column(String, nullable=True)
-    __table_args__ = (UniqueConstraint("text", name="uniq_cmd_text"),)
-
-class DbTgAuto(Base):
-    __tablename__ = "tg_auto"
-    id = Column(Integer, primary_key=True, index=True)
-    plugin_uid = Column(String, nullable=False)
-    params = Column(String, nullable=True)
-    info = Column(String, nullable=True)
\ No newline at end of file
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    # Read-only view of the whole config, built once and swapped as a unit
+    connects: MappingProxyType
+    users: frozenset
+    auto_users: tuple
+    text_cmds: MappingProxyType
+    buttons: MappingProxyType
+    menus: MappingProxyType
+    auto: tuple
+    version: str = None
+
+    def __reduce__(self):
+        # Mapping proxies do not pickle, the startup cache stores plain dicts
+        return (ConfigSnapshot.build, (dict(self.connects), self.users, self.auto_users, dict(self.text_cmds),
+                                       dict(self.buttons), dict(self.menus), self.auto, self.version))
+
+    @staticmethod
+    def build(connects: dict, users: frozenset, auto_users: tuple, text_cmds: dict,
+              buttons: dict, menus: dict, auto: tuple, version: str = None) -> Self:
+        return ConfigSnapshot(connects=MappingProxyType(connects),
+                              users=users,
+                              auto_users=auto_users,
+                              text_cmds=MappingProxyType(text_cmds),
+                              buttons=MappingProxyType(buttons),
+                              menus=MappingProxyType(menus),
+                              auto=auto,
+                              version=version
+                             )
\ No newline at end of file
@@ -0,0 +1,51 @@
+from module.core_class import TgConnect, TgMenu, TgButton, TgTextCmd, TgAuto, ConfigSnapshot
+from module.core_exception import CoreException
+
+from module.config import session
+
+class CoreConfig():
+    # Lookups on an in-memory ConfigSnapshot, no DB access and no SQLAlchemy import
+    def __init__(self, snapshot: ConfigSnapshot = None):
+        self.snapshot = snapshot
+        # tg_menu.id -> TgMenu, built on the first page switch
+        self.menu_ids = None
+
+    def get_connect(self) -> TgConnect:
+        if session not in self.snapshot.connects:
+            raise CoreException(f'Tg connect {session} not found')
+        return self.snapshot.connects[session]
+
+    def get_all_connect(self, sessions: list[str]) -> list[TgConnect]:
+        # ['*'] - every configured connect
+        if '*' in sessions:
+            return list(self.snapshot.connects.values())
+        missing = [name for name in sessions if name not in self.snapshot.connects]
+        if missing:
+            raise CoreException(f'Tg connect {", ".join(missing)} not found')
+        return [self.snapshot.connects[name] for name in sessions]
+
+    def get_auto_users(self) -> list[str]:
+        return list(self.snapshot.auto_users)
+
+    def get_menu(self, menu_text: str) -> TgMenu:
+        if menu_text not in self.snapshot.menus:
+            raise CoreException(f'Menu <{menu_text}> not found')
+        return self.snapshot.menus[menu_text]
+
+    def get_menu_by_id(self, menu_id: int) -> TgMenu:
+        # Menu of a page navigation button, None if the config no longer has it
+        if self.menu_ids is None:
+            self.menu_ids = {menu.id: menu for menu in self.snapshot.menus.values()}
+        return self.menu_ids.get(menu_id)
+
+    def get_text_cmd(self, txt_cmd_text: str) -> TgTextCmd:
+        return self.snapshot.text_cmds.get(txt_cmd_text)
+
+    def get_button(self, data: str) -> TgButton:
+        return self.snapshot.buttons.get(data)
+
+    def get_all_tg_auto(self) -> list[TgAuto]:
+        return list(self.snapshot.auto)
+
+    def  check_user(self, user_name: str) -> bool:
+        return user_name in self.snapshot.users
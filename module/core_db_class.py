@@ -0,0 +1,108 @@
+# SQLAlchemy tables of the config DB, kept apart from core_class so that
+# the bot can start from the startup cache without importing SQLAlchemy
+
+import json
+
+from sqlalchemy import  Column, Integer, Float, String, UniqueConstraint, ForeignKey, Index
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.orm import DeclarativeBase, relationship
+
+# Schema version in tg_meta, CoreDbConfig.__upgrade__ brings older DB files up to it
+SCHEMA_VERSION = 2
+
+class Base(DeclarativeBase): pass
+
+class Params(TypeDecorator):
+    # Plugin params: compact JSON text, NULL for no params; rows get a dict back
+    impl = String
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, str):
+            value = json.loads(value)
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':'), sort_keys=True) if value else None
+
+    def process_result_value(self, value, dialect):
+        return json.loads(value) if value else {}
+
+class DbTgConnect(Base):
+    __tablename__ = "tg_connect"
+    id = Column(Integer, primary_key=True)
+    api_id = Column(Integer, nullable=False)
+    api_hash = Column(String, nullable=False)
+    session = Column(String, nullable=False)
+    token = Column(String, nullable=False)
+    info = Column(String, nullable=True)
+    __table_args__ = (UniqueConstraint("session", name="uniq_session"),)
+
+class DbTgUser(Base):
+    __tablename__ = "tg_users"
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    auto_msg = Column(Integer, nullable=False)
+    info = Column(String, nullable=True)
+    # get_auto_users is answered by the index alone
+    __table_args__ = (UniqueConstraint("name", name="uniq_users"), Index("ix_tg_users_auto", "auto_msg", "name"),)
+
+class DbTgMenu(Base):
+    __tablename__ = "tg_menu"
+    id = Column(Integer, primary_key=True)
+    text = Column(String, nullable=False)
+    info = Column(String, nullable=True)
+    page_size = Column(Integer, nullable=True)
+    columns = Column(Integer, nullable=True)
+    __table_args__ = (UniqueConstraint("text", name="uniq_menu"),)
+
+class DbTgButton(Base):
+    __tablename__ = "tg_buttons"
+    id = Column(Integer, primary_key=True)
+    menu_id = Column(Integer, ForeignKey(DbTgMenu.id),nullable=False)
+    text = Column(String, nullable=False)
+    data = Column(String, nullable=False)
+    sorting = Column(Integer, nullable=False)
+    slot_type = Column(Integer, nullable=False)
+    slot_uid = Column(String, nullable=False)
+    # tg_menu.id of a menu slot, resolved from slot_uid when the config is loaded
+    slot_id = Column(Integer, ForeignKey(DbTgMenu.id), nullable=True)
+    params = Column(Params, nullable=True)
+    info = Column(String, nullable=True)
+    menu = relationship("DbTgMenu", backref='buttons', foreign_keys=[menu_id])
+    __table_args__ = (UniqueConstraint("data", name="uniq_btn"), UniqueConstraint("menu_id", "text", name="uniq_menu_btn"),
+                      Index("ix_tg_buttons_menu", "menu_id", "sorting"), Index("ix_tg_buttons_slot", "slot_id"),)
+
+class DbTgTextCmd(Base):
+    __tablename__ = "tg_txt_cmd"
+    id = Column(Integer, primary_key=True)
+    text = Column(String, nullable=False)
+    slot_type = Column(Integer, nullable=False)
+    slot_uid = Column(String, nullable=False)
+    slot_id = Column(Integer, ForeignKey(DbTgMenu.id), nullable=True)
+    params = Column(Params, nullable=True)
+    info = Column(String, nullable=True)
+    __table_args__ = (UniqueConstraint("text", name="uniq_cmd_text"), Index("ix_tg_txt_cmd_slot", "slot_id"),)
+
+class DbTgAuto(Base):
+    __tablename__ = "tg_auto"
+    id = Column(Integer, primary_key=True)
+    plugin_uid = Column(String, nullable=False)
+    params = Column(Params, nullable=True)
+    info = Column(String, nullable=True)
+    schedule = Column(String, nullable=True)
+    dedup = Column(String, nullable=True)
+
+class DbTgAutoState(Base):
+    __tablename__ = "tg_auto_state"
+    auto_id = Column(Integer, ForeignKey(DbTgAuto.id), primary_key=True)
+    last_run = Column(Float, nullable=False)
+
+class DbTgAutoSent(Base):
+    __tablename__ = "tg_auto_sent"
+    auto_id = Column(Integer, ForeignKey(DbTgAuto.id), primary_key=True)
+    chat = Column(String, primary_key=True)
+    digest = Column(String, nullable=False)
+    msg_ids = Column(String, nullable=True)
+
+class DbTgMeta(Base):
+    __tablename__ = "tg_meta"
+    key = Column(String, primary_key=True)
+    value = Column(String, nullable=True)
\ No newline at end of file
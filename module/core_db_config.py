@@ -1,36 +1,82 @@
+import copy
 import json
+import time
+import uuid
 import random
 from string import ascii_uppercase, digits
-from sqlalchemy import create_engine, or_, and_
+from sqlalchemy import inspect, text, insert, select, update, case
 from sqlalchemy.orm import  Session, aliased
 from sqlalchemy.exc import OperationalError, IntegrityError
 
-from module.core_class import TgConnect, TgUser, TgMenu, TgButton, TgTextCmd, SlotType, SignalType, TgAuto
-from module.core_class import Base, DbTgConnect, DbTgUser, DbTgMenu, DbTgButton, DbTgTextCmd, DbTgAuto
+from module.core_class import TgConnect, TgUser, TgMenu, TgButton, TgTextCmd, SlotType, TgAuto, ConfigSnapshot
+from module.core_db_class import SCHEMA_VERSION, Base, DbTgConnect, DbTgUser, DbTgMenu, DbTgButton, DbTgTextCmd, DbTgAuto, DbTgAutoState, DbTgAutoSent, DbTgMeta
+from module.core_check import check_config
 from module.core_plugin import CorePlugin
+from module.core_config import CoreConfig
+from module.core_metrics import metrics
+from module.core_storage import create_storage_engine
 from module.core_exception import CoreException
 
 from module.config import db_conn_str, session
 
-class CoreDbConfig():
+class CoreDbConfig(CoreConfig):
     def __init__(self, reset: bool = False):
         try:
-            self.engine = create_engine(db_conn_str, echo=False)
+            self.engine = create_storage_engine(db_conn_str)
             if reset:
                 Base.metadata.drop_all(self.engine)
             Base.metadata.create_all(self.engine)
-            self.uid = []
+            self.__upgrade__()
+            self.uid = set()
             self.errors = []
+            self.report = None
+            self.checked = None
+            super().__init__(None)
         except OperationalError as e:
             raise CoreException(msg="Internal error", data=str(e.args[0]))
 
 
+    def bound(self, conn) -> 'CoreDbConfig':
+        # The same methods on an open connection, e.g. inside AsyncConnection.run_sync
+        db = copy.copy(self)
+        db.engine = conn
+        return db
+
+    def __upgrade__(self) -> None:
+        # Add nullable columns introduced after the DB file was created
+        db = inspect(self.engine)
+        with self.engine.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                exists = {col['name'] for col in db.get_columns(table.name)}
+                for col in table.columns:
+                    if col.name not in exists and col.nullable:
+                        conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(self.engine.dialect)}'))
+            # Indexes declared after the tables were created
+            for table in Base.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(conn, checkfirst=True)
+        with Session(autoflush=False, bind=self.engine) as conn:
+            schema = conn.get(DbTgMeta, 'schema')
+            if schema is not None and int(schema.value) >= SCHEMA_VERSION:
+                return
+            # 1 -> 2: primary keys lose their duplicate index, slot references become ids,
+            # params are rewritten as compact JSON / NULL
+            for table in Base.metadata.sorted_tables:
+                conn.execute(text(f'DROP INDEX IF EXISTS ix_{table.name}_id'))
+            self.__resolve_slots__(conn)
+            for model in (DbTgButton, DbTgTextCmd, DbTgAuto):
+                rows = [{'id': rec.id, 'params': rec.params} for rec in conn.execute(select(model.id, model.params))]
+                if rows:
+                    conn.execute(update(model), rows)
+            conn.merge(DbTgMeta(key='schema', value=str(SCHEMA_VERSION)))
+            conn.commit()
+
     def __uid_generate__(self) -> str:
         all_symbols = ascii_uppercase + digits
         while True:
             uid = f'''{''.join(random.choice(all_symbols) for _ in range(8))}'''
             if uid not in self.uid:
-                self.uid.append(uid)
+                self.uid.add(uid)
                 return uid
 
     #ADD
@@ -60,7 +106,7 @@ class CoreDbConfig():
     def add_menu(self, menu: TgMenu):
         try:
             with Session(autoflush=False, bind=self.engine) as conn:
-                db_menu = DbTgMenu(text=menu.text , info=menu.info)
+                db_menu = DbTgMenu(text=menu.text , info=menu.info, page_size=menu.page_size, columns=menu.columns)
                 for s, tg_btn in enumerate(menu.get_all_buttons()):
                     uid_data = self.__uid_generate__()
                     db_btn = DbTgButton(text=tg_btn.text,
@@ -68,7 +114,7 @@ class CoreDbConfig():
                                         sorting=s+1,
                                         slot_type=tg_btn.slot_type.value,
                                         slot_uid=tg_btn.slot_uid,
-                                        params=json.dumps(tg_btn.params),
+                                        params=tg_btn.params,
                                         info=tg_btn.info
                                        )
                     db_btn.menu = db_menu
@@ -83,7 +129,7 @@ class CoreDbConfig():
                 db_txt_cmd = DbTgTextCmd(text=txt_cmd.text.upper(),
                                          slot_type=txt_cmd.slot_type.value,
                                          slot_uid=txt_cmd.slot_uid,
-                                         params=json.dumps(txt_cmd.params),
+                                         params=txt_cmd.params,
                                          info=txt_cmd.info
                                         )
                 conn.add(db_txt_cmd)
@@ -94,14 +140,282 @@ class CoreDbConfig():
     def add_tg_auto(self, auto: TgAuto) -> None:
         try:
             with Session(autoflush=False, bind=self.engine) as conn:
-                conn.add(DbTgAuto(plugin_uid=auto.plugin_uid, params=json.dumps(auto.params), info=auto.info))
+                conn.add(DbTgAuto(plugin_uid=auto.plugin_uid, params=auto.params, info=auto.info, schedule=auto.schedule, dedup=auto.dedup))
+                conn.commit()
+        except IntegrityError as e:
+            raise CoreException(msg="Internal error", data=str(e.args[0]))
+
+    # BULK
+
+    def load_config(self, data: dict) -> dict:
+        # Insert a whole JSON config in one transaction, return seconds spent per section
+        timing = {}
+        try:
+            with Session(autoflush=False, bind=self.engine) as conn:
+                start = time.perf_counter()
+                conns = [TgConnect().from_dict(rec) for rec in data['connect']]
+                if conns:
+                    conn.execute(insert(DbTgConnect), [{'api_id': c.api_id, 'api_hash': c.api_hash, 'session': c.session,
+                                                        'token': c.token, 'info': c.info} for c in conns])
+                timing['connect'] = time.perf_counter() - start
+
+                start = time.perf_counter()
+                users = [TgUser().from_dict(rec) for rec in data['users']]
+                if users:
+                    conn.execute(insert(DbTgUser), [{'name': u.name, 'auto_msg': u.auto_msg, 'info': u.info} for u in users])
+                timing['users'] = time.perf_counter() - start
+
+                start = time.perf_counter()
+                menus = [TgMenu().from_dict(rec) for rec in data['menu']]
+                if menus:
+                    conn.execute(insert(DbTgMenu), [{'text': m.text, 'info': m.info, 'page_size': m.page_size, 'columns': m.columns} for m in menus])
+                    menu_id = {rec.text: rec.id for rec in conn.execute(select(DbTgMenu.id, DbTgMenu.text))}
+                    self.uid.update(conn.scalars(select(DbTgButton.data)))
+                    buttons = [{'menu_id': menu_id[m.text],
+                                'text': b.text,
+                                'data': self.__uid_generate__(),
+                                'sorting': s + 1,
+                                'slot_type': b.slot_type.value,
+                                'slot_uid': b.slot_uid,
+                                'params': b.params,
+                                'info': b.info} for m in menus for s, b in enumerate(m.get_all_buttons())]
+                    if buttons:
+                        conn.execute(insert(DbTgButton), buttons)
+                timing['menu'] = time.perf_counter() - start
+
+                start = time.perf_counter()
+                cmds = [TgTextCmd().from_dict(rec) for rec in data['text_command']]
+                if cmds:
+                    conn.execute(insert(DbTgTextCmd), [{'text': c.text.upper(), 'slot_type': c.slot_type.value, 'slot_uid': c.slot_uid,
+                                                        'params': c.params, 'info': c.info} for c in cmds])
+                timing['text_command'] = time.perf_counter() - start
+
+                start = time.perf_counter()
+                autos = [TgAuto().from_dict(rec) for rec in data['auto']]
+                if autos:
+                    conn.execute(insert(DbTgAuto), [{'plugin_uid': a.plugin_uid, 'params': a.params, 'info': a.info,
+                                                     'schedule': a.schedule, 'dedup': a.dedup} for a in autos])
+                timing['auto'] = time.perf_counter() - start
+
+                start = time.perf_counter()
+                self.__resolve_slots__(conn)
+                conn.commit()
+                timing['commit'] = time.perf_counter() - start
+            return timing
+        except KeyError as k:
+            raise CoreException(f'Config: KeyError: {k.args[0]}')
+        except IntegrityError as e:
+            raise CoreException(msg="Internal error", data=[str(e.args[0])])
+
+    # SYNC
+
+    def sync_config(self, data: dict, pl: CorePlugin = None) -> dict:
+        # Apply only the difference between a JSON config and the tables in one transaction.
+        # Rows are matched by their natural key, so existing button data uids stay valid.
+        # Nothing is committed unless the new config passes the integrity check (self.report).
+        # Return section -> (inserted, updated, deleted)
+        try:
+            conns = {c.session: {'api_id': c.api_id, 'api_hash': c.api_hash, 'session': c.session, 'token': c.token, 'info': c.info}
+                     for c in (TgConnect().from_dict(rec) for rec in data['connect'])}
+            users = {u.name: {'name': u.name, 'auto_msg': u.auto_msg, 'info': u.info}
+                     for u in (TgUser().from_dict(rec) for rec in data['users'])}
+            menus = [TgMenu().from_dict(rec) for rec in data['menu']]
+            cmds = {c.text.upper(): {'text': c.text.upper(), 'slot_type': c.slot_type.value, 'slot_uid': c.slot_uid,
+                                     'params': c.params, 'info': c.info}
+                    for c in (TgTextCmd().from_dict(rec) for rec in data['text_command'])}
+            autos = {}
+            for a in (TgAuto().from_dict(rec) for rec in data['auto']):
+                key = self.__auto_key__(autos, a.plugin_uid, json.dumps(a.params, sort_keys=True))
+                autos[key] = {'plugin_uid': a.plugin_uid, 'params': a.params, 'info': a.info,
+                              'schedule': a.schedule, 'dedup': a.dedup}
+            result = {}
+            with Session(autoflush=False, bind=self.engine) as conn:
+                result['connect'] = self.__sync_rows__(conn, DbTgConnect, {r.session: r for r in conn.query(DbTgConnect).all()}, conns)
+                result['users'] = self.__sync_rows__(conn, DbTgUser, {r.name: r for r in conn.query(DbTgUser).all()}, users)
+
+                db_menus = {r.text: r for r in conn.query(DbTgMenu).all()}
+                db_buttons = {(rec.text, rec.DbTgButton.text): rec.DbTgButton
+                              for rec in conn.query(DbTgButton, DbTgMenu.text).join(DbTgMenu, DbTgButton.menu_id==DbTgMenu.id).all()}
+                wanted_menus = {m.text: {'text': m.text, 'info': m.info, 'page_size': m.page_size, 'columns': m.columns} for m in menus}
+                wanted_buttons = {}
+                for m in menus:
+                    for s, b in enumerate(m.get_all_buttons()):
+                        wanted_buttons[(m.text, b.text)] = {'text': b.text, 'sorting': s + 1, 'slot_type': b.slot_type.value,
+                                                            'slot_uid': b.slot_uid, 'params': b.params, 'info': b.info}
+                # Buttons go first, a deleted menu must not keep rows pointing at it
+                deleted = [db_buttons.pop(key) for key in list(db_buttons) if key not in wanted_buttons]
+                for rec in deleted:
+                    conn.delete(rec)
+                # So are slot references to a deleted menu, __resolve_slots__ sets them again
+                gone = [r.id for key, r in db_menus.items() if key not in wanted_menus]
+                if gone:
+                    for model in (DbTgButton, DbTgTextCmd):
+                        conn.execute(update(model).where(model.slot_id.in_(gone)).values(slot_id=None))
+                conn.flush()
+                result['menu'] = self.__sync_rows__(conn, DbTgMenu, db_menus, wanted_menus)
+                conn.flush()
+                menu_id = {r.text: r.id for r in conn.query(DbTgMenu).all()}
+                self.uid.update(r.data for r in db_buttons.values())
+                for key, values in wanted_buttons.items():
+                    values['menu_id'] = menu_id[key[0]]
+                    if key not in db_buttons:
+                        values['data'] = self.__uid_generate__()
+                ins, upd, _ = self.__sync_rows__(conn, DbTgButton, db_buttons, wanted_buttons)
+                result['buttons'] = (ins, upd, len(deleted))
+
+                result['text_command'] = self.__sync_rows__(conn, DbTgTextCmd, {r.text: r for r in conn.query(DbTgTextCmd).all()}, cmds)
+
+                db_autos = {}
+                for r in conn.query(DbTgAuto).order_by(DbTgAuto.id).all():
+                    db_autos[self.__auto_key__(db_autos, r.plugin_uid, json.dumps(r.params, sort_keys=True))] = r
+                gone = [r.id for key, r in db_autos.items() if key not in autos]
+                if gone:
+                    conn.query(DbTgAutoState).filter(DbTgAutoState.auto_id.in_(gone)).delete()
+                    conn.query(DbTgAutoSent).filter(DbTgAutoSent.auto_id.in_(gone)).delete()
+                result['auto'] = self.__sync_rows__(conn, DbTgAuto, db_autos, autos)
+                conn.flush()
+                self.__resolve_slots__(conn)
+                # The result is checked before the commit, a broken config leaves the DB as it was
+                if not self.check_errors_integrity(pl, self.__read_snapshot__(conn)):
+                    conn.rollback()
+                    return result
                 conn.commit()
+            return result
+        except KeyError as k:
+            raise CoreException(f'Config: KeyError: {k.args[0]}')
+        except IntegrityError as e:
+            raise CoreException(msg="Internal error", data=[str(e.args[0])])
+
+    def __resolve_slots__(self, conn: Session) -> None:
+        # slot_id = tg_menu.id of every menu slot, NULL for plugins and missing menus
+        for model in (DbTgButton, DbTgTextCmd):
+            menu_id = select(DbTgMenu.id).where(DbTgMenu.text==model.slot_uid).scalar_subquery()
+            conn.execute(update(model).values(slot_id=case((model.slot_type==SlotType.menu.value, menu_id), else_=None)))
+
+    def __auto_key__(self, keys: dict, plugin_uid: str, params: str) -> tuple:
+        # Auto tasks have no natural key, the n-th task with the same plugin and params matches the n-th one
+        n = 0
+        while (plugin_uid, params, n) in keys:
+            n += 1
+        return (plugin_uid, params, n)
+
+    def __sync_rows__(self, conn: Session, model, current: dict, wanted: dict) -> tuple:
+        inserted = updated = deleted = 0
+        for key, rec in current.items():
+            if key not in wanted:
+                conn.delete(rec)
+                deleted += 1
+        for key, values in wanted.items():
+            rec = current.get(key)
+            if rec is None:
+                conn.add(model(**values))
+                inserted += 1
+            elif any(getattr(rec, k) != v for k, v in values.items()):
+                for k, v in values.items():
+                    setattr(rec, k, v)
+                updated += 1
+        return (inserted, updated, deleted)
+
+    # VERSION
+
+    @metrics.timed('db')
+    def get_version(self) -> str:
+        try:
+            with Session(autoflush=False, bind=self.engine) as conn:
+                rec = conn.get(DbTgMeta, 'version')
+                return None if rec is None else rec.value
         except IntegrityError as e:
             raise CoreException(msg="Internal error", data=str(e.args[0]))
 
+    def bump_version(self) -> str:
+        # Tell running bots that the config changed
+        version = uuid.uuid4().hex
+        try:
+            with Session(autoflush=False, bind=self.engine) as conn:
+                conn.merge(DbTgMeta(key='version', value=version))
+                conn.commit()
+            return version
+        except IntegrityError as e:
+            raise CoreException(msg="Internal error", data=str(e.args[0]))
+
+    # SNAPSHOT
+
+    def reload(self, snapshot: ConfigSnapshot = None) -> ConfigSnapshot:
+        # Rebuild the in-memory config and swap it in with a single assignment
+        if snapshot is None:
+            snapshot = self.__read_snapshot__()
+        self.snapshot = snapshot
+        self.menu_ids = None
+        return snapshot
+
+    def __read_snapshot__(self, conn: Session = None) -> ConfigSnapshot:
+        # conn: read inside an open transaction, sync_config checks its changes before the commit
+        if conn is None:
+            try:
+                with Session(autoflush=False, bind=self.engine) as conn:
+                    return self.__read_snapshot__(conn)
+            except IntegrityError as e:
+                raise CoreException(msg="Internal error", data=str(e.args[0]))
+        version = conn.get(DbTgMeta, 'version')
+        connects = {rec.session: TgConnect(api_id=rec.api_id,
+                                           api_hash=rec.api_hash,
+                                           session=rec.session,
+                                           token=rec.token,
+                                           info=rec.info
+                                          )
+                    for rec in conn.query(DbTgConnect).all()}
+        db_users = conn.query(DbTgUser).all()
+        # Menu slots are joined by slot_id, slot_uid is left only for a menu that does not exist
+        slot = aliased(DbTgMenu)
+        text_cmds = {rec.DbTgTextCmd.text: TgTextCmd(text=rec.DbTgTextCmd.text,
+                                                     slot_type=SlotType(rec.DbTgTextCmd.slot_type),
+                                                     slot_uid=rec.slot_text or rec.DbTgTextCmd.slot_uid,
+                                                     params=rec.DbTgTextCmd.params,
+                                                     info=rec.DbTgTextCmd.info,
+                                                     data=None
+                                                    )
+                     for rec in (conn.query(DbTgTextCmd, slot.text.label('slot_text'))
+                                 .join(slot, DbTgTextCmd.slot_id==slot.id, isouter=True).all())}
+        buttons = {}
+        menus = {}
+        for rec in (conn.query(DbTgMenu, DbTgButton, slot.text.label('slot_text'))
+                    .join(DbTgButton, DbTgButton.menu_id==DbTgMenu.id, isouter=True)
+                    .join(slot, DbTgButton.slot_id==slot.id, isouter=True)
+                    .order_by(DbTgMenu.id, DbTgButton.sorting).all()):
+            tg_menu = menus.get(rec.DbTgMenu.text)
+            if tg_menu is None:
+                tg_menu = menus[rec.DbTgMenu.text] = TgMenu(text=rec.DbTgMenu.text, info=rec.DbTgMenu.info, page_size=rec.DbTgMenu.page_size,
+                                                            columns=rec.DbTgMenu.columns, id=rec.DbTgMenu.id)
+            if rec.DbTgButton is None:
+                # Menu without buttons, kept for the integrity check
+                continue
+            tg_btn = TgButton(text=rec.DbTgButton.text,
+                              slot_type=SlotType(rec.DbTgButton.slot_type),
+                              slot_uid=rec.slot_text or rec.DbTgButton.slot_uid,
+                              params=rec.DbTgButton.params,
+                              info=rec.DbTgButton.info,
+                              data=rec.DbTgButton.data
+                             )
+            tg_menu.add_button(tg_btn)
+            buttons[tg_btn.data] = tg_btn
+        auto = tuple(TgAuto(plugin_uid=rec.plugin_uid, params=rec.params, info=rec.info, schedule=rec.schedule, dedup=rec.dedup, id=rec.id)
+                     for rec in conn.query(DbTgAuto).order_by(DbTgAuto.id).all())
+        return ConfigSnapshot.build(connects=connects,
+                                    users=frozenset(rec.name for rec in db_users),
+                                    auto_users=tuple(rec.name for rec in db_users if rec.auto_msg),
+                                    text_cmds=text_cmds,
+                                    buttons=buttons,
+                                    menus=menus,
+                                    auto=auto,
+                                    version=None if version is None else version.value
+                                   )
+
     # GET
 
+    @metrics.timed('db')
     def get_connect(self) -> TgConnect:
+        if self.snapshot is not None:
+            return super().get_connect()
         try:
             with Session(autoflush=False, bind=self.engine) as conn:
                 db_conn = conn.query(DbTgConnect).filter(DbTgConnect.session==session).one_or_none()
@@ -116,14 +430,38 @@ class CoreDbConfig():
         except IntegrityError as e:
             raise CoreException(msg="Internal error", data=str(e.args[0]))
 
+    @metrics.timed('db')
+    def get_all_connect(self, sessions: list[str]) -> list[TgConnect]:
+        if self.snapshot is not None:
+            return super().get_all_connect(sessions)
+        try:
+            with Session(autoflush=False, bind=self.engine) as conn:
+                query = conn.query(DbTgConnect)
+                if '*' not in sessions:
+                    query = query.filter(DbTgConnect.session.in_(sessions))
+                result = [TgConnect(api_id=rec.api_id, api_hash=rec.api_hash, session=rec.session, token=rec.token, info=rec.info)
+                          for rec in query.all()]
+                missing = set(sessions) - {'*'} - {rec.session for rec in result}
+                if missing:
+                    raise CoreException(f'Tg connect {", ".join(sorted(missing))} not found')
+                return result
+        except IntegrityError as e:
+            raise CoreException(msg="Internal error", data=str(e.args[0]))
+
+    @metrics.timed('db')
     def get_auto_users(self) -> list[str]:
+        if self.snapshot is not None:
+            return super().get_auto_users()
         try:
             with Session(autoflush=False, bind=self.engine) as conn:
                 return [rec.name for rec in conn.query(DbTgUser).filter(DbTgUser.auto_msg==True).all()]
         except IntegrityError as e:
             raise CoreException(msg="Internal error", data=str(e.args[0]))
 
+    @metrics.timed('db')
     def get_menu(self, menu_text: str) -> TgMenu:
+        if self.snapshot is not None:
+            return super().get_menu(menu_text)
         try:
             with Session(autoflush=False, bind=self.engine) as conn:
                 db_menu = (conn.query(DbTgMenu, DbTgButton)
@@ -132,12 +470,13 @@ class CoreDbConfig():
                           )
                 if 0 == len(db_menu):
                     raise CoreException(f'Menu <{menu_text}> not found')
-                tg_menu = TgMenu(text=db_menu[0].DbTgMenu.text, info=db_menu[0].DbTgMenu.info)
+                tg_menu = TgMenu(text=db_menu[0].DbTgMenu.text, info=db_menu[0].DbTgMenu.info, page_size=db_menu[0].DbTgMenu.page_size,
+                                 columns=db_menu[0].DbTgMenu.columns, id=db_menu[0].DbTgMenu.id)
                 for rec in db_menu:
                     tg_menu.add_button(TgButton(text=rec.DbTgButton.text,
                                                 slot_type=SlotType(rec.DbTgButton.slot_type),
                                                 slot_uid=rec.DbTgButton.slot_uid,
-                                                params=json.loads(rec.DbTgButton.params),
+                                                params=rec.DbTgButton.params,
                                                 info=rec.DbTgButton.info,
                                                 data=rec.DbTgButton.data
                                                )
@@ -146,7 +485,21 @@ class CoreDbConfig():
         except IntegrityError as e:
             raise CoreException(msg="Internal error", data=str(e.args[0]))
 
+    @metrics.timed('db')
+    def get_menu_by_id(self, menu_id: int) -> TgMenu:
+        if self.snapshot is not None:
+            return super().get_menu_by_id(menu_id)
+        try:
+            with Session(autoflush=False, bind=self.engine) as conn:
+                db_menu = conn.get(DbTgMenu, menu_id)
+        except IntegrityError as e:
+            raise CoreException(msg="Internal error", data=str(e.args[0]))
+        return None if db_menu is None else self.get_menu(db_menu.text)
+
+    @metrics.timed('db')
     def get_text_cmd(self, txt_cmd_text: str) -> TgTextCmd:
+        if self.snapshot is not None:
+            return super().get_text_cmd(txt_cmd_text)
         try:
             with Session(autoflush=False, bind=self.engine) as conn:
                 db_txt_cmd = conn.query(DbTgTextCmd).filter(DbTgTextCmd.text==txt_cmd_text).one_or_none()
@@ -156,14 +509,17 @@ class CoreDbConfig():
                     return TgTextCmd(text=db_txt_cmd.text,
                                      slot_type=SlotType(db_txt_cmd.slot_type),
                                      slot_uid=db_txt_cmd.slot_uid,
-                                     params=json.loads(db_txt_cmd.params),
+                                     params=db_txt_cmd.params,
                                      info=db_txt_cmd.info,
                                      data=None
                                     )
         except IntegrityError as e:
             raise CoreException(msg="Internal error", data=str(e.args[0]))
 
+    @metrics.timed('db')
     def get_button(self, data: str) -> TgButton:
+        if self.snapshot is not None:
+            return super().get_button(data)
         try:
             with Session(autoflush=False, bind=self.engine) as conn:
                 db_btn= conn.query(DbTgButton).filter(DbTgButton.data==data).one_or_none()
@@ -173,17 +529,58 @@ class CoreDbConfig():
                     return TgButton(text=db_btn.text,
                                     slot_type=SlotType(db_btn.slot_type),
                                     slot_uid=db_btn.slot_uid,
-                                    params=json.loads(db_btn.params),
+                                    params=db_btn.params,
                                     info=db_btn.info,
                                     data=db_btn.data
                                    )
         except IntegrityError as e:
             raise CoreException(msg="Internal error", data=str(e.args[0]))
 
+    @metrics.timed('db')
     def get_all_tg_auto(self) -> list[TgAuto]:
+        if self.snapshot is not None:
+            return super().get_all_tg_auto()
         try:
             with Session(autoflush=False, bind=self.engine) as conn:
-                return [TgAuto(plugin_uid=rec.plugin_uid, params=json.loads(rec.params), info=rec.info) for rec in conn.query(DbTgAuto).all()]
+                return [TgAuto(plugin_uid=rec.plugin_uid, params=rec.params, info=rec.info, schedule=rec.schedule, dedup=rec.dedup, id=rec.id)
+                        for rec in conn.query(DbTgAuto).order_by(DbTgAuto.id).all()]
+        except IntegrityError as e:
+            raise CoreException(msg="Internal error", data=str(e.args[0]))
+
+    @metrics.timed('db')
+    def get_auto_last_run(self) -> dict:
+        try:
+            with Session(autoflush=False, bind=self.engine) as conn:
+                return {rec.auto_id: rec.last_run for rec in conn.query(DbTgAutoState).all()}
+        except IntegrityError as e:
+            raise CoreException(msg="Internal error", data=str(e.args[0]))
+
+    def set_auto_last_run(self, auto_id: int, last_run: float) -> None:
+        try:
+            with Session(autoflush=False, bind=self.engine) as conn:
+                conn.merge(DbTgAutoState(auto_id=auto_id, last_run=last_run))
+                conn.commit()
+        except IntegrityError as e:
+            raise CoreException(msg="Internal error", data=str(e.args[0]))
+
+    @metrics.timed('db')
+    def get_auto_sent(self, auto_id: int) -> dict:
+        # chat -> (output digest, [message id, ...]) of the last auto message
+        try:
+            with Session(autoflush=False, bind=self.engine) as conn:
+                return {rec.chat: (rec.digest, json.loads(rec.msg_ids) if rec.msg_ids else [])
+                        for rec in conn.query(DbTgAutoSent).filter(DbTgAutoSent.auto_id==auto_id).all()}
+        except IntegrityError as e:
+            raise CoreException(msg="Internal error", data=str(e.args[0]))
+
+    def set_auto_sent(self, auto_id: int, sent: dict) -> None:
+        # Replace the whole state of the task, chats that are gone drop out
+        try:
+            with Session(autoflush=False, bind=self.engine) as conn:
+                conn.query(DbTgAutoSent).filter(DbTgAutoSent.auto_id==auto_id).delete()
+                conn.add_all([DbTgAutoSent(auto_id=auto_id, chat=chat, digest=digest, msg_ids=json.dumps(msg_ids))
+                              for chat, (digest, msg_ids) in sent.items()])
+                conn.commit()
         except IntegrityError as e:
             raise CoreException(msg="Internal error", data=str(e.args[0]))
 
@@ -193,6 +590,8 @@ class CoreDbConfig():
     # CHECK
 
     def  check_user(self, user_name: str) -> bool:
+        if self.snapshot is not None:
+            return super().check_user(user_name)
         try:
             with Session(autoflush=False, bind=self.engine) as conn:
                 db_user = conn.query(DbTgUser).filter(DbTgUser.name==user_name).one_or_none()
@@ -200,52 +599,17 @@ class CoreDbConfig():
         except IntegrityError as e:
             raise CoreException(msg="Internal error", data=str(e.args[0]))
 
-    def  check_errors_integrity(self) -> bool:
-        try:
-            self.errors.clear()
+    def  check_errors_integrity(self, pl: CorePlugin = None, snapshot: ConfigSnapshot = None) -> bool:
+        # Check a fresh (or the given) snapshot against the plugin catalog, the checked
+        # snapshot is kept in self.checked so the caller can install it without a second read
+        if pl is None:
             pl = CorePlugin()
-            plugin_list = pl.plugins()
-            with Session(autoflush=False, bind=self.engine) as conn:
-                # Check session
-                if 0 == conn.query(DbTgConnect).filter(DbTgConnect.session==session).count():
-                    self.errors.append(f'Session <{session}> not found')
-                # Check users
-                if 0 == conn.query(DbTgUser).count():
-                    self.errors.append(f'Users not found')
-                # Check menu
-                if 0 != conn.query(DbTgMenu).count():
-                    # All menus have buttons
-                    for rec in (conn.query(DbTgMenu, DbTgButton)
-                                .join(DbTgButton, DbTgButton.menu_id==DbTgMenu.id, isouter=True)
-                                .filter(DbTgButton.id.is_(None)).all()):
-                        self.errors.append(f'''Menu <{rec[0].text}> has no buttons''')
-                    # Check Buttons slot link to menu object
-                    menu_slot = aliased(DbTgMenu)
-                    for rec in (conn.query(DbTgMenu, DbTgButton, menu_slot)
-                                .join(DbTgButton, DbTgButton.menu_id==DbTgMenu.id, isouter=True)
-                                .join(menu_slot, DbTgButton.slot_uid==menu_slot.text, isouter=True)
-                                .filter(and_(DbTgButton.slot_type==1, menu_slot.id.is_(None))).all()):
-                        self.errors.append(f'''Button <{rec[1].text}> in menu <{rec[0].text}> calls up non-existent menu <{rec[1].slot_uid}>''')
-                    # Check Buttons slot link to plugin object
-                    for rec in (conn.query(DbTgMenu, DbTgButton)
-                                .join(DbTgButton, DbTgButton.menu_id==DbTgMenu.id, isouter=True)
-                                .filter(and_(DbTgButton.slot_type==2, DbTgButton.slot_uid.notin_(plugin_list))).all()):
-                        self.errors.append(f'''Button <{rec[1].text}> in menu <{rec[0].text}> calls up non-existent plugin <{rec[1].slot_uid}>''')
-                # Check Text Command
-                if 0 == conn.query(DbTgTextCmd).count():
-                    self.errors.append(f'''Text Command not found''')
-                else:
-                    # Check Text Command slot link to menu object
-                    for rec in (conn.query(DbTgTextCmd, DbTgMenu)
-                                .join(DbTgMenu, DbTgTextCmd.slot_uid==DbTgMenu.text, isouter=True)
-                                .filter(and_(DbTgTextCmd.slot_type==1, DbTgMenu.id.is_(None))).all()):
-                        self.errors.append(f'''Text Command <{rec[0].text}> calls up non-existent menu <{rec[0].slot_uid}>''')
-                    # Check Text Command slot link to plugin object
-                    for rec in (conn.query(DbTgTextCmd)
-                                .filter(and_(DbTgTextCmd.slot_type==2, DbTgTextCmd.slot_uid.notin_(plugin_list))).all()):
-                        self.errors.append(f'''Text Command <{rec.text}> calls up non-existent plugin <{rec.slot_uid}>''')
-                    for rec in (conn.query(DbTgAuto).filter(DbTgAuto.plugin_uid.notin_(plugin_list)).all()):
-                        self.errors.append(f'''Auto Command  calls up non-existent plugin <{rec.plugin_uid}>''')
-            return 0 == len(self.errors)
-        except IntegrityError as e:
-            raise CoreException(msg="Internal error", data=str(e.args[0]))
\ No newline at end of file
+        if snapshot is None:
+            snapshot = self.__read_snapshot__()
+        self.report = check_config(snapshot, pl.plugins(), session)
+        # A broken or duplicate plugin file is only an error once the config calls a uid
+        # without a loaded version, and check_config reports that as a missing plugin
+        self.report.warnings[:0] = pl.errors
+        self.errors = list(self.report.errors)
+        self.checked = snapshot
+        return self.report.ok()
@@ -0,0 +1,47 @@
+import json
+import hashlib
+
+from module.core_class import Reply, TgAuto
+from module.core import Core
+
+class CoreDedup():
+    # Suppresses unchanged auto messages per chat (TgAuto.dedup = 'skip'),
+    # or turns them into edits of the previous messages (TgAuto.dedup = 'edit').
+    # State is one row per (auto task, chat) in tg_auto_sent.
+    def __init__(self, core: Core) -> None:
+        self.core = core
+        # auto id -> {chat: (digest, [message id, ...])}
+        self.sent = {}
+
+    @staticmethod
+    def digest(reply: Reply) -> str:
+        return hashlib.sha1(json.dumps([reply.text, list(reply.data)], ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+    def plan(self, auto: TgAuto, users: list[str], reply: Reply) -> tuple[str, list]:
+        # Return the output digest and [(chat, (msg, message id to edit or None)), ...]
+        digest = self.digest(reply)
+        sent = self.__load__(auto)
+        messages = []
+        for user in users:
+            last_digest, msg_ids = sent.get(user, (None, []))
+            if last_digest == digest:
+                continue
+            if auto.dedup != 'edit' or len(msg_ids) != len(reply.data):
+                msg_ids = [None] * len(reply.data)
+            messages.extend((user, (msg, msg_id)) for msg, msg_id in zip(reply.data, msg_ids))
+        return digest, messages
+
+    def commit(self, auto: TgAuto, users: list[str], digest: str, results: dict) -> None:
+        # results: chat -> [sent message or None, ...]; a chat is updated only if every message went out
+        sent = self.__load__(auto)
+        for chat, msgs in results.items():
+            if msgs and all(m is not None for m in msgs):
+                sent[chat] = (digest, [getattr(m, 'id', None) for m in msgs])
+        self.sent[auto.id] = {chat: sent[chat] for chat in users if chat in sent}
+        self.core.db.set_auto_sent(auto.id, self.sent[auto.id])
+
+    def __load__(self, auto: TgAuto) -> dict:
+        sent = self.sent.get(auto.id)
+        if sent is None:
+            sent = self.sent[auto.id] = self.core.db.get_auto_sent(auto.id)
+        return sent
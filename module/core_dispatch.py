@@ -0,0 +1,186 @@
+import time
+import asyncio
+import inspect
+from typing import AsyncIterator
+from types import SimpleNamespace
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from module.core import Core
+from module.core_class import Request, Reply, ReplyType, PluginCall
+from module.core_plugin import CorePlugin
+from module.core_metrics import metrics
+from module.core_sandbox import CoreSandbox
+from module.core_exception import CoreException
+
+from module.config import dispatch_mode, dispatch_workers, plugin_limit, plugin_timeout, sandbox_plugins, sandbox_cpu_limit, sandbox_memory_limit
+
+# Plugin registry of a worker process, built on the first call
+worker_plugins = None
+
+def run_plugin_process(uid: str, args: list, params: dict) -> Reply:
+    global worker_plugins
+    if worker_plugins is None:
+        worker_plugins = CorePlugin()
+    else:
+        worker_plugins.refresh()
+    module = worker_plugins.load(uid)
+    if module is None:
+        raise CoreException(f'Configuration error. Module {uid} not found')
+    return module.Plugin(args, params).run()
+
+class CoreDispatch():
+    # Runs Core requests without blocking the event loop:
+    #   async def run          -> awaited on the loop
+    #   async def run + yield  -> streamed on the loop, Reply by Reply
+    #   def run                -> thread or process pool
+    #   sandboxed def run      -> CoreSandbox worker with CPU and memory limits
+    def __init__(self, core: Core, mode: str = dispatch_mode, workers: int = dispatch_workers):
+        self.core = core
+        self.mode = mode
+        if mode in ('thread', 'sandbox'):
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='plugin')
+        elif mode == 'process':
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            raise CoreException(f'Unknown dispatch mode <{mode}>')
+        # Pre-started when it is known to be needed, otherwise on the first Plugin.sandbox call
+        self.sandbox = CoreSandbox() if mode == 'sandbox' or sandbox_plugins else None
+        # uid -> asyncio.Semaphore
+        self.limits = {}
+        # Plugin calls queued on a semaphore and running
+        self.waiting = 0
+        self.running = 0
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.sandbox is not None:
+            self.sandbox.shutdown()
+
+    async def user_request(self, request: Request) -> Reply:
+        result = self.core.route(request)
+        if isinstance(result, PluginCall):
+            return await self.run(result)
+        return result
+
+    async def stream(self, request: Request) -> AsyncIterator[Reply]:
+        # Same as user_request, but streaming plugins yield each Reply as soon as it is ready
+        result = self.core.route(request)
+        if isinstance(result, PluginCall):
+            async for reply in self.run_stream(result):
+                yield reply
+        elif result is not None:
+            yield result
+
+    async def plugin_class(self, uid: str):
+        # A plugin not imported yet (startup cache) is imported in the default executor,
+        # so the loop never runs module code or waits for a refresh holding the lock
+        if self.core.pl.loaded(uid):
+            return self.core.get_plugin(uid)
+        return await asyncio.get_running_loop().run_in_executor(None, self.core.get_plugin, uid)
+
+    async def run(self, call: PluginCall) -> Reply:
+        cls = await self.plugin_class(call.uid)
+        if inspect.isasyncgenfunction(cls.run):
+            # Callers that need a single Reply get all chunks joined
+            chunks = [reply async for reply in self.run_stream(call)]
+            if not chunks:
+                return None
+            return Reply(type=chunks[0].type, text=chunks[0].text, data=[x for reply in chunks for x in reply.data], rewrite=chunks[0].rewrite)
+        reply = self.core.results.get(call, cls)
+        if reply is not None:
+            return reply
+        timeout = getattr(cls, 'timeout', plugin_timeout)
+        async with self.__slot__(call.uid, cls) as slot:
+            try:
+                with metrics.timer('plugin', call.uid):
+                    reply = await self.__execute__(call, cls, timeout, slot)
+                self.core.results.put(call, cls, reply)
+                return reply
+            except asyncio.TimeoutError:
+                return Reply(type=ReplyType.error, text=f'Plugin <{call.uid}> timeout', data=[f'Plugin <{call.uid}> exceeded {timeout} s'])
+
+    async def __execute__(self, call: PluginCall, cls, timeout: float, slot) -> Reply:
+        is_async = inspect.iscoroutinefunction(cls.run)
+        # dispatch_mode = 'sandbox' takes the sync plugins, an async plugin goes there only when it asks for it
+        if (self.mode == 'sandbox' and not is_async) or getattr(cls, 'sandbox', False) or call.uid in sandbox_plugins:
+            if self.sandbox is None:
+                self.sandbox = CoreSandbox()
+            return await self.sandbox.run(call, timeout, getattr(cls, 'cpu_limit', sandbox_cpu_limit),
+                                          getattr(cls, 'memory_limit', sandbox_memory_limit))
+        if is_async:
+            return await asyncio.wait_for(cls(call.args, call.params).run(), timeout)
+        loop = asyncio.get_running_loop()
+        if self.mode == 'process':
+            future = loop.run_in_executor(self.executor, run_plugin_process, call.uid, call.args, call.params)
+        else:
+            future = loop.run_in_executor(self.executor, self.core.run_plugin, call.uid, call.args, call.params)
+        # Shielded: a timeout cannot stop the thread or process, the future tells when it ends
+        slot.future = future
+        return await asyncio.wait_for(asyncio.shield(future), timeout)
+
+    async def run_stream(self, call: PluginCall) -> AsyncIterator[Reply]:
+        # The timeout applies to each chunk, not to the whole stream
+        cls = await self.plugin_class(call.uid)
+        if not inspect.isasyncgenfunction(cls.run):
+            reply = await self.run(call)
+            if reply is not None:
+                yield reply
+            return
+        timeout = getattr(cls, 'timeout', plugin_timeout)
+        async with self.__slot__(call.uid, cls):
+            gen = cls(call.args, call.params).run()
+            start = time.perf_counter()
+            error = False
+            try:
+                while True:
+                    try:
+                        reply = await asyncio.wait_for(anext(gen), timeout)
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        error = True
+                        yield Reply(type=ReplyType.error, text=f'Plugin <{call.uid}> timeout', data=[f'Plugin <{call.uid}> exceeded {timeout} s per reply'])
+                        break
+                    yield reply
+            except Exception:
+                error = True
+                raise
+            finally:
+                metrics.observe('plugin', call.uid, time.perf_counter() - start, error)
+                await gen.aclose()
+
+    @asynccontextmanager
+    async def __slot__(self, uid: str, cls):
+        # Plugin semaphore, counting the calls waiting for it and running.
+        # slot.future: executor work of the call; a thread or process still running after
+        # a timeout keeps the slot until it ends, so a hung plugin cannot fill the executor
+        sem = self.__limit__(uid, cls)
+        slot = SimpleNamespace(future=None)
+        self.waiting += 1
+        try:
+            await sem.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            yield slot
+        finally:
+            if slot.future is None or slot.future.done():
+                self.__release__(sem)
+            else:
+                slot.future.add_done_callback(lambda f: self.__release__(sem, f))
+
+    def __release__(self, sem: asyncio.Semaphore, future: asyncio.Future = None) -> None:
+        if future is not None and not future.cancelled():
+            # Nobody awaits the result of a timed out call any more
+            future.exception()
+        self.running -= 1
+        sem.release()
+
+    def __limit__(self, uid: str, cls) -> asyncio.Semaphore:
+        # Per plugin concurrency, overridden by a Plugin.concurrency class attribute
+        sem = self.limits.get(uid)
+        if sem is None:
+            sem = self.limits[uid] = asyncio.Semaphore(getattr(cls, 'concurrency', plugin_limit))
+        return sem
@@ -0,0 +1,55 @@
+import asyncio
+
+from module.core_class import Request
+from module.core_sender import TokenBucket
+
+from module.config import user_rate, user_burst, max_inflight
+
+class CoreLimiter():
+    # In front of core_request:
+    #   per user token bucket     -> 'limited', the request is dropped
+    #   same (user, type, data)   -> 'coalesced', waits for the request already running
+    #   global in-flight cap      -> 'overload', the caller answers "busy"
+    def __init__(self, rate: float = user_rate, burst: int = user_burst, inflight: int = max_inflight) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.inflight = inflight
+        # username -> TokenBucket
+        self.buckets = {}
+        # (scope, username, type, data) -> asyncio.Task
+        self.running = {}
+        self.counters = {'accepted': 0, 'limited': 0, 'coalesced': 0, 'overload': 0}
+
+    async def run(self, request: Request, handler, scope: str = None) -> str:
+        # scope separates the requests of different bot sessions for coalescing
+        key = (scope, request.username, request.type, request.data)
+        task = self.running.get(key)
+        if task is not None:
+            self.counters['coalesced'] += 1
+            await asyncio.shield(task)
+            return 'coalesced'
+        if not self.__bucket__(request.username).take():
+            self.counters['limited'] += 1
+            return 'limited'
+        if len(self.running) >= self.inflight:
+            self.counters['overload'] += 1
+            return 'overload'
+        self.counters['accepted'] += 1
+        task = self.running[key] = asyncio.ensure_future(handler(request))
+        try:
+            await asyncio.shield(task)
+        finally:
+            self.running.pop(key, None)
+        return 'accepted'
+
+    def __bucket__(self, username: str) -> TokenBucket:
+        bucket = self.buckets.get(username)
+        if bucket is None:
+            if len(self.buckets) >= 4 * self.inflight + 1024:
+                # Forget idle users, a full bucket is the same as a new one
+                self.buckets = {k: v for k, v in self.buckets.items() if not v.full()}
+            bucket = self.buckets[username] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    def __str__(self) -> str:
+        return ' '.join(f'{k}={v}' for k, v in self.counters.items()) + f' inflight={len(self.running)}'
@@ -0,0 +1,100 @@
+# Non-blocking logging: callers only put records on a bounded queue, a listener thread
+# formats and writes them (rotating file + console). A full queue drops the record
+# instead of blocking the event loop. The request context (session, username, chat_id, command)
+# set with log_context() is attached to every record logged inside it.
+
+import json
+import time
+import queue
+import atexit
+import logging
+import contextvars
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+from module.config import log_format, log_rotate, log_max_bytes, log_backups, log_when, log_queue_size
+
+request_context = contextvars.ContextVar('request_context', default={})
+context_fields = ('session', 'username', 'chat_id', 'command', 'duration')
+
+@contextmanager
+def log_context(**kwargs):
+    token = request_context.set({**request_context.get(), **kwargs})
+    try:
+        yield
+    finally:
+        request_context.reset(token)
+
+class ContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        for k, v in request_context.get().items():
+            if not hasattr(record, k):
+                setattr(record, k, v)
+        return True
+
+class DropQueueHandler(QueueHandler):
+    # Drop on overload: a full queue never blocks the caller
+    def __init__(self, q: queue.Queue) -> None:
+        super().__init__(q)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f'.{int(record.msecs):03d}',
+                'level': record.levelname,
+                'logger': record.name,
+                'msg': record.getMessage()}
+        for k in context_fields:
+            v = getattr(record, k, None)
+            if v is not None:
+                if k == 'duration':
+                    data['duration_ms'] = round(v * 1000, 1)
+                else:
+                    data[k] = v
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    def __init__(self) -> None:
+        super().__init__("%(asctime)s %(levelname)s %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        ctx = ' '.join(f'{k}={getattr(record, k)}' for k in context_fields if getattr(record, k, None) is not None and k != 'duration')
+        if getattr(record, 'duration', None) is not None:
+            ctx += f' duration={record.duration * 1000:.1f}ms'
+        return f'{line} [{ctx.strip()}]' if ctx.strip() else line
+
+# logger name -> (DropQueueHandler, QueueListener)
+pipelines = {}
+
+def get_logger(name: str, path: str, console: bool = True) -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    if name in pipelines:
+        return logger
+    if log_rotate == 'time':
+        file_handler = TimedRotatingFileHandler(path, when=log_when, backupCount=log_backups, encoding='utf-8')
+    else:
+        file_handler = RotatingFileHandler(path, mode='a', maxBytes=log_max_bytes, backupCount=log_backups, encoding='utf-8')
+    handlers = [file_handler] + ([logging.StreamHandler()] if console else [])
+    formatter = JsonFormatter() if log_format == 'json' else TextFormatter()
+    for h in handlers:
+        h.setFormatter(formatter)
+    handler = DropQueueHandler(queue.Queue(log_queue_size))
+    handler.addFilter(ContextFilter())
+    listener = QueueListener(handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.addHandler(handler)
+    pipelines[name] = (handler, listener)
+    return logger
+
+def dropped() -> int:
+    # Records dropped by all queue handlers since the start
+    return sum(handler.dropped for handler, listener in pipelines.values())
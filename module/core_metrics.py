@@ -0,0 +1,158 @@
+# Counters, errors and latency histograms per (metric, label), plus gauges read on demand.
+# Exposed as Prometheus text (serve) and as a short summary for the /metrics command.
+# With metrics_enabled = False timed() returns the function as it is and timer() a shared no-op.
+
+import time
+import asyncio
+import threading
+import functools
+from contextlib import nullcontext
+
+from module.config import metrics_enabled
+
+buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Histogram():
+    def __init__(self) -> None:
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.errors = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float, error: bool = False) -> None:
+        n = 0
+        while n < len(buckets) and seconds > buckets[n]:
+            n += 1
+        self.counts[n] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+        if error:
+            self.errors += 1
+
+    def quantile(self, q: float) -> float:
+        # Upper bound of the bucket holding the q quantile
+        rank = q * self.count
+        total = 0
+        for n, count in enumerate(self.counts):
+            total += count
+            if total >= rank and count:
+                return buckets[n] if n < len(buckets) else self.max
+        return 0.0
+
+class Timer():
+    def __init__(self, metrics, name: str, label: str) -> None:
+        self.metrics = metrics
+        self.name = name
+        self.label = label
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.metrics.observe(self.name, self.label, time.perf_counter() - self.start, exc_type is not None)
+
+class CoreMetrics():
+    def __init__(self, enabled: bool = metrics_enabled) -> None:
+        self.enabled = enabled
+        # (name, label) -> Histogram
+        self.histograms = {}
+        # name -> callable returning a number
+        self.gauges = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def observe(self, name: str, label: str, seconds: float, error: bool = False) -> None:
+        if not self.enabled:
+            return
+        with self.lock:
+            hist = self.histograms.get((name, label))
+            if hist is None:
+                hist = self.histograms[(name, label)] = Histogram()
+            hist.observe(seconds, error)
+
+    def timer(self, name: str, label: str):
+        if not self.enabled:
+            return nullcontext()
+        return Timer(self, name, label)
+
+    def timed(self, name: str, label: str = None):
+        # Decorator, the label defaults to the function name
+        def wrap(func):
+            if not self.enabled:
+                return func
+            tag = label or func.__name__
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with Timer(self, name, tag):
+                    return func(*args, **kwargs)
+            return wrapper
+        return wrap
+
+    def gauge(self, name: str, func) -> None:
+        self.gauges[name] = func
+
+    def prometheus(self) -> str:
+        with self.lock:
+            items = sorted((key, (list(h.counts), h.count, h.errors, h.sum)) for key, h in self.histograms.items())
+        lines = []
+        last = None
+        for (name, label), (counts, count, errors, total) in items:
+            if name != last:
+                lines.append(f'# TYPE tg_bot_{name}_seconds histogram')
+                last = name
+            label = str(label).replace('\\', '\\\\').replace('"', '\\"')
+            cum = 0
+            for le, n in zip(buckets, counts):
+                cum += n
+                lines.append(f'tg_bot_{name}_seconds_bucket{{label="{label}",le="{le}"}} {cum}')
+            lines.append(f'tg_bot_{name}_seconds_bucket{{label="{label}",le="+Inf"}} {count}')
+            lines.append(f'tg_bot_{name}_seconds_sum{{label="{label}"}} {total:.6f}')
+            lines.append(f'tg_bot_{name}_seconds_count{{label="{label}"}} {count}')
+            lines.append(f'tg_bot_{name}_errors_total{{label="{label}"}} {errors}')
+        for name, func in sorted(self.gauges.items()):
+            try:
+                value = func()
+            except Exception:
+                continue
+            lines.append(f'# TYPE tg_bot_{name} gauge')
+            lines.append(f'tg_bot_{name} {value}')
+        lines.append(f'tg_bot_uptime_seconds {time.time() - self.started:.0f}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self, name: str = None) -> list[str]:
+        # One line per (metric, label): count, errors, average, p95 and max in ms
+        if not self.enabled:
+            return ['Metrics disabled']
+        result = []
+        with self.lock:
+            for (metric, label), h in sorted(self.histograms.items()):
+                if name is not None and metric != name:
+                    continue
+                result.append(f'{metric} <{label}>: n={h.count} err={h.errors} avg={h.sum / h.count * 1000:.1f}ms '
+                              f'p95<={h.quantile(0.95) * 1000:.0f}ms max={h.max * 1000:.1f}ms')
+        for gauge, func in sorted(self.gauges.items()):
+            try:
+                result.append(f'{gauge}: {func()}')
+            except Exception:
+                pass
+        return result
+
+    async def serve(self, host: str, port: int) -> asyncio.AbstractServer:
+        # Minimal HTTP endpoint, any GET returns the Prometheus text
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            try:
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                body = self.prometheus().encode('utf-8')
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                             + f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('ascii') + body)
+                await writer.drain()
+            finally:
+                writer.close()
+        return await asyncio.start_server(handle, host, port)
+
+# Process wide registry
+metrics = CoreMetrics()
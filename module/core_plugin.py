@@ -1,46 +1,144 @@
 import importlib.util
 import os
+import sys
 import inspect
+import threading
 from types import ModuleType
 
+from module.core_metrics import metrics
 from module.core_exception import CoreException
 from module.config import plugin_path
 
 class CorePlugin():
-    def __init__(self) -> None:
-        pass
+    def __init__(self, catalog: dict = None) -> None:
+        # (uid -> path, path -> (mtime, uid, module)), module is None until the first load of a cached entry.
+        # One tuple replaced in one assignment, readers never pair the registry of one refresh with the files of another
+        self.table = ({}, {})
+        # path -> import error
+        self.failed = {}
+        self.errors = []
+        self.lock = threading.Lock()
+        if catalog is not None and {path: mtime for path, (mtime, uid) in catalog.items()} == self.__scan__():
+            # Plugin files unchanged since the catalog was saved, import on first use
+            files = {path: (mtime, uid, None) for path, (mtime, uid) in catalog.items()}
+            registry, self.errors = self.__build_registry__(files)
+            self.table = (registry, files)
+        else:
+            self.refresh()
 
-    def __get_plugins__(self) -> dict:
+    def __scan__(self) -> dict:
+        # path -> mtime of every plugin file
         result = {}
         dir_path = os.path.abspath(plugin_path)
-        for f in [x for x in os.listdir(dir_path) if x.endswith(".py")]:
+        for f in sorted(x for x in os.listdir(dir_path) if x.endswith(".py")):
             full_path = os.path.join(dir_path, f)
             if not os.path.isfile(full_path):
                 continue
-            uid = self.__get_plugin_uid__(full_path)
-            if uid is not None:
-                result[uid] = full_path
+            result[full_path] = os.stat(full_path).st_mtime_ns
         return result
 
+    def refresh(self) -> bool:
+        # Re-import only new or changed files, return True if the registry changed.
+        # A file that fails to import keeps serving its previous version.
+        with self.lock:
+            scan = self.__scan__()
+            files = {}
+            failed = {}
+            changed = scan.keys() != self.files.keys()
+            for path, mtime in scan.items():
+                rec = self.files.get(path)
+                if rec is not None and rec[0] == mtime:
+                    files[path] = rec
+                    if path in self.failed:
+                        failed[path] = self.failed[path]
+                    continue
+                changed = True
+                try:
+                    with metrics.timer('plugin_load', os.path.basename(path)):
+                        module = self.__import_module_from_path__(path)
+                    files[path] = (mtime, self.__get_plugin_uid__(module), module)
+                except Exception as e:
+                    failed[path] = f'{e.msg}: {"; ".join(e.data)}' if isinstance(e, CoreException) else f'Plugin error <{path}>: {e}'
+                    # Remember the new mtime so a broken file is not re-imported on every pass
+                    files[path] = (mtime, None, None) if rec is None else (mtime, rec[1], rec[2])
+            if changed:
+                registry, errors = self.__build_registry__(files)
+                self.failed = failed
+                self.errors = errors + list(failed.values())
+                # Single assignment, readers see either the old or the new table
+                self.table = (registry, files)
+            return changed
+
+    def __build_registry__(self, files: dict) -> tuple[dict, list]:
+        registry = {}
+        errors = []
+        origin = {}
+        for path, (mtime, uid, module) in files.items():
+            if uid is None:
+                continue
+            if uid in registry:
+                errors.append(f'Plugin <{uid}> in <{path}> duplicates <{origin[uid]}>')
+                continue
+            registry[uid] = path
+            origin[uid] = path
+        return registry, errors
+
+    @property
+    def registry(self) -> dict:
+        return self.table[0]
+
+    @property
+    def files(self) -> dict:
+        return self.table[1]
+
     def plugins(self):
-        return list(self.__get_plugins__().keys())
+        return list(self.registry.keys())
+
+    def catalog(self) -> dict:
+        # path -> (mtime, uid), what the startup cache needs to skip the imports
+        return {path: (mtime, uid) for path, (mtime, uid, module) in self.files.items()}
+
+    def loaded(self, uid: str) -> bool:
+        # True if load(uid) returns at once: no import and no wait for the lock
+        registry, files = self.table
+        rec = files.get(registry.get(uid))
+        return rec is None or rec[2] is not None
 
     def load(self, uid: str) -> ModuleType:
-        pl = self.__get_plugins__()
-        if uid in pl:
-            return self.__import_module_from_path__(pl[uid])
-        else:
+        registry, files = self.table
+        rec = files.get(registry.get(uid))
+        if rec is None:
             return None
+        if rec[2] is None:
+            with self.lock:
+                # A concurrent refresh may have replaced the table, look the uid up again
+                registry, files = self.table
+                path = registry.get(uid)
+                rec = files.get(path)
+                if rec is None:
+                    return None
+                if rec[2] is None:
+                    with metrics.timer('plugin_load', uid):
+                        rec = files[path] = (rec[0], rec[1], self.__import_module_from_path__(path))
+        return rec[2]
 
-    def __get_plugin_uid__(self, path: str) -> str:
-        plugin = self.__import_module_from_path__(path)
+    def __get_plugin_uid__(self, plugin: ModuleType) -> str:
         for cls in inspect.getmembers(plugin, inspect.isclass):
             if cls[0] == 'Plugin':
-                return plugin.Plugin().get_uid()
+                return plugin.Plugin.get_uid()
         return None
 
+    def __module_name__(self, path: str) -> str:
+        # Unique module name per plugin file
+        return f'''{os.path.basename(os.path.abspath(plugin_path))}.{os.path.splitext(os.path.basename(path))[0]}'''
+
     def __import_module_from_path__(self, path: str) -> ModuleType:
-        spec = importlib.util.spec_from_file_location("plugin", path)
-        module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(module)
-        return module
\ No newline at end of file
+        try:
+            name = self.__module_name__(path)
+            spec = importlib.util.spec_from_file_location(name, path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            sys.modules[name] = module
+            return module
+        except Exception as e:
+            raise CoreException(msg=f'Plugin import error <{path}>', data=[str(e)])
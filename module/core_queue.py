@@ -0,0 +1,173 @@
+# Inbound requests between the Telegram handlers and the Core.
+# The handlers only put a request and return, a pool of workers takes them lane by lane
+# (lane 0 first, arrival order within a lane); queue_reserved of the workers take lane 0 only,
+# so buttons never wait behind long plugin commands. With queue_path every accepted request is
+# written to a SQLite file and deleted when done, so the requests a crash interrupted are
+# replayed on the next start (at least once: a request may run again if the crash came mid-reply)
+
+import time
+import queue
+import asyncio
+import sqlite3
+import itertools
+import threading
+from collections import deque
+
+from module.core_class import Request, SignalType
+
+from module.config import queue_path, queue_workers, queue_reserved, queue_busy_depth, queue_replay_age
+
+LANES = 2
+
+class CoreQueue():
+    def __init__(self, path: str = queue_path, workers: int = queue_workers, reserved: int = queue_reserved,
+                 busy: int = queue_busy_depth, replay_age: float = queue_replay_age) -> None:
+        self.path = path
+        self.workers = workers
+        # At least one worker takes every lane
+        self.reserved = max(0, min(reserved, workers - 1))
+        self.busy = busy
+        self.replay_age = replay_age
+        self.conn = None
+        # lane -> deque of (row id, request, session, future)
+        self.lanes = tuple(deque() for _ in range(LANES))
+        # Workers waiting for a request: (lanes they take, future)
+        self.idle = deque()
+        self.ids = itertools.count(1)
+        self.tasks = []
+        # Writes for the writer thread: ('insert', row), ('delete', id), None - stop
+        self.writes = queue.SimpleQueue()
+        self.writer = None
+        self.counters = {'accepted': 0, 'busy': 0, 'done': 0, 'failed': 0, 'replayed': 0, 'expired': 0, 'write_errors': 0}
+
+    def __open__(self) -> None:
+        # WAL with synchronous=NORMAL: a request survives a crash of the bot, not of the OS
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS inbound (id INTEGER PRIMARY KEY, lane INTEGER, session TEXT,
+                             type TEXT, chat_id INTEGER, msg_id INTEGER, username TEXT, data TEXT, created REAL)''')
+        self.conn.commit()
+
+    def depth(self) -> int:
+        return sum(len(lane) for lane in self.lanes)
+
+    def put(self, request: Request, session: str, lane: int = 0) -> asyncio.Future:
+        # None - the queue is over queue_busy_depth and the caller answers "busy",
+        # otherwise a future done when a worker has handled the request
+        if self.depth() >= self.busy:
+            self.counters['busy'] += 1
+            return None
+        row_id = None
+        if self.writer is not None:
+            # Written by the writer thread, the loop never waits for the disk
+            row_id = next(self.ids)
+            self.writes.put(('insert', (row_id, lane, session, request.type.name, request.chat_id, request.msg_id,
+                                        request.username, request.data, time.time())))
+        self.counters['accepted'] += 1
+        future = asyncio.get_running_loop().create_future()
+        self.lanes[lane].append((row_id, request, session, future))
+        self.__wake__(lane)
+        return future
+
+    def __wake__(self, lane: int) -> None:
+        # Wake the first idle worker that takes this lane
+        for i, (lanes, waiter) in enumerate(self.idle):
+            if lane in lanes and not waiter.done():
+                del self.idle[i]
+                waiter.set_result(None)
+                return
+
+    def __take__(self, lanes: tuple):
+        for lane in lanes:
+            if self.lanes[lane]:
+                return self.lanes[lane].popleft()
+        return None
+
+    async def start(self, handler) -> None:
+        # handler(request, session) is awaited by the workers; requests left by the previous run go first
+        if self.path is not None and self.conn is None:
+            self.__open__()
+            self.__replay__()
+            self.writer = threading.Thread(target=self.__writer__, name='queue-writer', daemon=True)
+            self.writer.start()
+        for n in range(self.workers):
+            lanes = (0,) if n < self.reserved else tuple(range(LANES))
+            self.tasks.append(asyncio.create_task(self.__worker__(handler, lanes)))
+
+    def __replay__(self) -> None:
+        loop = asyncio.get_running_loop()
+        oldest = time.time() - self.replay_age
+        rows = self.conn.execute('SELECT id, lane, session, type, chat_id, msg_id, username, data, created FROM inbound ORDER BY id').fetchall()
+        for row_id, lane, session, type, chat_id, msg_id, username, data, created in rows:
+            if created < oldest:
+                # Too late to answer, the user has moved on
+                self.counters['expired'] += 1
+                self.conn.execute('DELETE FROM inbound WHERE id=?', (row_id,))
+                continue
+            request = Request(type=SignalType[type], chat_id=chat_id, msg_id=msg_id, username=username, data=data)
+            self.counters['replayed'] += 1
+            self.lanes[min(lane, LANES - 1)].append((row_id, request, session, loop.create_future()))
+        self.conn.commit()
+        self.ids = itertools.count(rows[-1][0] + 1 if rows else 1)
+
+    def __writer__(self) -> None:
+        # Everything queued since the last pass goes in one transaction
+        stop = False
+        while not stop:
+            ops = [self.writes.get()]
+            while True:
+                try:
+                    ops.append(self.writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self.conn:
+                    for op in ops:
+                        if op is None:
+                            stop = True
+                        elif op[0] == 'insert':
+                            self.conn.execute('INSERT INTO inbound (id, lane, session, type, chat_id, msg_id, username, data, created) VALUES (?,?,?,?,?,?,?,?,?)', op[1])
+                        else:
+                            self.conn.execute('DELETE FROM inbound WHERE id=?', (op[1],))
+            except sqlite3.Error:
+                self.counters['write_errors'] += 1
+        self.conn.close()
+
+    async def __worker__(self, handler, lanes: tuple) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            item = self.__take__(lanes)
+            if item is None:
+                waiter = loop.create_future()
+                self.idle.append((lanes, waiter))
+                await waiter
+                continue
+            row_id, request, session, future = item
+            try:
+                await handler(request, session)
+                self.counters['done'] += 1
+            except Exception:
+                # The handler logs its own errors, a failed request is not retried
+                self.counters['failed'] += 1
+            # Cancelled by stop() mid-request: the row stays and the request is replayed
+            if row_id is not None:
+                self.writes.put(('delete', row_id))
+            if not future.done():
+                future.set_result(None)
+
+    async def stop(self) -> None:
+        # Requests still queued stay in the file for the next start
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.idle.clear()
+        if self.writer is not None:
+            self.writes.put(None)
+            await asyncio.get_running_loop().run_in_executor(None, self.writer.join)
+            self.writer = None
+            self.conn = None
+
+    def __str__(self) -> str:
+        return ' '.join(f'{k}={v}' for k, v in self.counters.items()) + f' depth={self.depth()}'
@@ -0,0 +1,65 @@
+import json
+import time
+from collections import OrderedDict
+
+from module.core_class import Reply, ReplyType, PluginCall
+
+from module.config import result_cache_size
+
+class CoreResultCache():
+    # LRU of plugin replies for plugins with a Plugin.cache_ttl class attribute (s).
+    # Key: plugin uid + args + params; an entry made by an older version of the plugin is a miss
+    def __init__(self, size: int = result_cache_size) -> None:
+        self.size = size
+        # key -> (expires, Plugin class, Reply)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def ttl(cls) -> float:
+        return getattr(cls, 'cache_ttl', 0) or 0
+
+    @staticmethod
+    def key(call: PluginCall) -> tuple:
+        return (call.uid, tuple(str(x) for x in call.args), json.dumps(call.params, sort_keys=True, default=str))
+
+    def get(self, call: PluginCall, cls) -> Reply:
+        if self.size <= 0 or self.ttl(cls) <= 0:
+            return None
+        key = self.key(call)
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic() or entry[1] is not cls:
+            self.entries.pop(key, None)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def put(self, call: PluginCall, cls, reply: Reply) -> None:
+        # Errors and empty results are not cached
+        ttl = self.ttl(cls)
+        if self.size <= 0 or ttl <= 0 or reply is None or ReplyType.error == reply.type:
+            return
+        key = self.key(call)
+        self.entries[key] = (time.monotonic() + ttl, cls, reply)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def purge(self, uid: str = None) -> int:
+        # Drop all entries, or the entries of one plugin; returns the number dropped
+        if uid is None:
+            count = len(self.entries)
+            self.entries.clear()
+            return count
+        keys = [key for key in self.entries if key[0] == uid]
+        for key in keys:
+            del self.entries[key]
+        return len(keys)
+
+    def __str__(self) -> str:
+        total = self.hits + self.misses
+        ratio = self.hits / total if total else 0.0
+        return f'hits={self.hits} misses={self.misses} ratio={ratio:.2f} size={len(self.entries)}/{self.size}'
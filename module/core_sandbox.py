@@ -0,0 +1,161 @@
+import math
+import signal
+import asyncio
+import inspect
+import multiprocessing
+try:
+    import resource
+except ImportError:
+    # No rlimits on Windows, the wall-clock timeout still applies
+    resource = None
+
+from module.core_class import Reply, ReplyType, PluginCall
+from module.core_exception import CoreException
+
+from module.config import sandbox_workers, sandbox_max_calls, sandbox_cpu_limit, sandbox_memory_limit, sandbox_start
+
+def sandbox_worker(conn, max_calls: int) -> None:
+    # Worker process: imports the plugins once, then runs calls until max_calls or None.
+    # Message in: (uid, args, params, cpu seconds, memory MB);
+    # out: (True, Reply) or (False, msg, data, True if the worker exits after this call)
+    from module.core_plugin import CorePlugin
+    plugins = CorePlugin()
+    calls = 0
+    while max_calls <= 0 or calls < max_calls:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        if msg is None:
+            break
+        uid, args, params, cpu, memory = msg
+        calls += 1
+        try:
+            plugins.refresh()
+            module = plugins.load(uid)
+            if module is None:
+                raise CoreException(f'Configuration error. Module {uid} not found')
+            __set_limits__(cpu, memory)
+            try:
+                result = module.Plugin(args, params).run()
+                if inspect.iscoroutine(result):
+                    result = asyncio.run(result)
+            finally:
+                __set_limits__(0, 0)
+            conn.send((True, result))
+        except MemoryError:
+            conn.send((False, f'Plugin <{uid}> exceeded the memory limit {memory} MB', [], True))
+            # The heap may be fragmented or half-built objects left behind, start clean
+            break
+        except CoreException as e:
+            conn.send((False, e.msg, list(e.data), False))
+        except Exception as e:
+            conn.send((False, f'Plugin <{uid}> error', [f'{type(e).__name__}: {e}'], False))
+    conn.close()
+
+def __set_limits__(cpu: float, memory: float) -> None:
+    # Soft limits for the next call, 0 - unlimited. CPU time is cumulative per process,
+    # so the call gets what it has already used plus its own budget
+    if resource is None:
+        return
+    if cpu > 0:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        soft = math.ceil(usage.ru_utime + usage.ru_stime + cpu)
+    else:
+        soft = resource.RLIM_INFINITY
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, resource.getrlimit(resource.RLIMIT_CPU)[1]))
+    soft = int(memory * 2**20) if memory > 0 else resource.RLIM_INFINITY
+    resource.setrlimit(resource.RLIMIT_AS, (soft, resource.getrlimit(resource.RLIMIT_AS)[1]))
+
+class SandboxWorker():
+    def __init__(self, ctx, max_calls: int) -> None:
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=sandbox_worker, args=(child, max_calls), daemon=True)
+        self.process.start()
+        child.close()
+        self.calls = 0
+        self.max_calls = max_calls
+
+    def spent(self) -> bool:
+        return self.max_calls > 0 and self.calls >= self.max_calls
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.conn.close()
+
+class CoreSandbox():
+    # Pool of warm worker processes for untrusted or heavy sync plugins.
+    # A call that hits the wall-clock timeout, the CPU limit or the memory limit costs
+    # only its worker, which is replaced; workers are also recycled after max_calls
+    def __init__(self, workers: int = sandbox_workers, max_calls: int = sandbox_max_calls) -> None:
+        self.ctx = multiprocessing.get_context(sandbox_start)
+        self.max_calls = max_calls
+        self.workers = [SandboxWorker(self.ctx, max_calls) for _ in range(workers)]
+        self.idle = list(self.workers)
+        self.free = None
+        self.recycled = 0
+        self.killed = 0
+
+    async def run(self, call: PluginCall, timeout: float, cpu: float = sandbox_cpu_limit, memory: float = sandbox_memory_limit) -> Reply:
+        if self.free is None:
+            # Created on the running loop
+            self.free = asyncio.Semaphore(len(self.workers))
+        async with self.free:
+            worker = self.idle.pop()
+            try:
+                return await self.__execute__(worker, call, timeout, cpu, memory)
+            finally:
+                if worker.spent() or not worker.process.is_alive() or worker.conn.closed:
+                    worker = self.__replace__(worker)
+                self.idle.append(worker)
+
+    async def __execute__(self, worker: SandboxWorker, call: PluginCall, timeout: float, cpu: float, memory: float) -> Reply:
+        loop = asyncio.get_running_loop()
+        worker.calls += 1
+        worker.conn.send((call.uid, call.args, call.params, cpu, memory))
+        ready = loop.create_future()
+        fd = worker.conn.fileno()
+        loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await asyncio.wait_for(ready, timeout)
+        except asyncio.TimeoutError:
+            worker.kill()
+            self.killed += 1
+            return Reply(type=ReplyType.error, text=f'Plugin <{call.uid}> timeout', data=[f'Plugin <{call.uid}> exceeded {timeout} s, worker killed'])
+        except asyncio.CancelledError:
+            # The reply would be left in the pipe for the next call
+            worker.kill()
+            raise
+        finally:
+            loop.remove_reader(fd)
+        try:
+            result = worker.conn.recv()
+        except (EOFError, OSError):
+            # The worker died: SIGXCPU for the CPU limit, or a crash in the plugin
+            worker.process.join(1)
+            code = worker.process.exitcode
+            worker.kill()
+            self.killed += 1
+            reason = f'exceeded the CPU limit {cpu} s' if code == -getattr(signal, 'SIGXCPU', 24) else f'worker exited with code {code}'
+            return Reply(type=ReplyType.error, text=f'Plugin <{call.uid}> failed', data=[f'Plugin <{call.uid}> {reason}'])
+        if result[0]:
+            return result[1]
+        if result[3]:
+            worker.kill()
+        raise CoreException(msg=result[1], data=result[2])
+
+    def __replace__(self, worker: SandboxWorker) -> SandboxWorker:
+        if worker.spent():
+            # The worker exits on its own after max_calls, nothing to wait for here
+            self.recycled += 1
+        worker.kill()
+        new = SandboxWorker(self.ctx, self.max_calls)
+        self.workers[self.workers.index(worker)] = new
+        return new
+
+    def shutdown(self) -> None:
+        for worker in self.workers:
+            worker.kill()
+
+    def __str__(self) -> str:
+        return f'workers={len(self.workers)} idle={len(self.idle)} recycled={self.recycled} killed={self.killed}'
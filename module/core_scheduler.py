@@ -0,0 +1,115 @@
+import time
+import heapq
+import random
+from datetime import datetime, timedelta
+
+from module.core_class import TgAuto
+from module.core_exception import CoreException
+
+from module.config import sleep_sys_msg, auto_jitter
+
+class Schedule():
+    # Interval: 30, "30s", "5m", "1h", "1d"
+    # Cron: "minute hour day month weekday" with *, */n, a-b, a,b (weekday 0 or 7 = Sunday).
+    # As in cron, a day matches either field when both day and weekday are restricted
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    limits = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, spec: str = None) -> None:
+        self.spec = spec
+        self.interval = None
+        self.cron = None
+        self.day_or = False
+        if spec is None or str(spec).strip() == '':
+            self.interval = sleep_sys_msg
+            return
+        spec = str(spec).strip()
+        try:
+            if len(spec.split()) == 5:
+                fields = spec.split()
+                self.cron = [self.__parse_field__(f, lo, hi) for f, (lo, hi) in zip(fields, self.limits)]
+                self.cron[4] = frozenset(d % 7 for d in self.cron[4])
+                self.day_or = not fields[2].startswith('*') and not fields[4].startswith('*')
+            elif spec[-1] in self.units:
+                self.interval = float(spec[:-1]) * self.units[spec[-1]]
+            else:
+                self.interval = float(spec)
+        except ValueError:
+            raise CoreException(f'Schedule <{spec}>: wrong format')
+        if self.interval is not None and self.interval <= 0:
+            raise CoreException(f'Schedule <{spec}>: interval must be positive')
+
+    def __parse_field__(self, field: str, lo: int, hi: int) -> frozenset:
+        result = set()
+        for part in field.split(','):
+            rng, _, step = part.partition('/')
+            step = int(step) if step else 1
+            if rng == '*':
+                start, end = lo, hi
+            elif '-' in rng:
+                start, end = (int(x) for x in rng.split('-'))
+            else:
+                start = end = int(rng)
+            if start < lo or end > hi or start > end or step < 1:
+                raise ValueError(field)
+            result.update(range(start, end + 1, step))
+        return frozenset(result)
+
+    def next_run(self, after: float) -> float:
+        if self.interval is not None:
+            return after + self.interval
+        minute, hour, day, month, weekday = self.cron
+        t = datetime.fromtimestamp(after).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        end = t + timedelta(days=366 * 4)
+        while t < end:
+            # datetime.weekday(): 0 = Monday, cron: 0 = Sunday
+            day_ok, weekday_ok = t.day in day, (t.weekday() + 1) % 7 in weekday
+            if t.month not in month or not ((day_ok or weekday_ok) if self.day_or else (day_ok and weekday_ok)):
+                t = (t + timedelta(days=1)).replace(hour=0, minute=0)
+            elif t.hour not in hour:
+                t = (t + timedelta(hours=1)).replace(minute=0)
+            elif t.minute not in minute:
+                t += timedelta(minutes=1)
+            else:
+                return t.timestamp()
+        raise CoreException(f'Schedule <{self.spec}>: never runs')
+
+class CoreScheduler():
+    # Heap of (start, due, auto id): due is the nominal run time the schedule counts from,
+    # start adds the jitter, so the jitter never accumulates. A job still running when it is due again is skipped.
+    # running - ids of the jobs in flight, shared with the scheduler this one replaces
+    def __init__(self, autos: list[TgAuto], last_run: dict = {}, now: float = None, running: set = None) -> None:
+        now = time.time() if now is None else now
+        self.autos = {auto.id: auto for auto in autos}
+        self.schedules = {auto.id: Schedule(auto.schedule) for auto in autos}
+        self.running = set() if running is None else running
+        self.heap = []
+        for auto in autos:
+            last = last_run.get(auto.id)
+            # Never run or overdue jobs start spread over the jitter window, not all at once
+            when = now if last is None else max(now, self.schedules[auto.id].next_run(last))
+            heapq.heappush(self.heap, (when + random.uniform(0, auto_jitter), when, auto.id))
+
+    def next_delay(self, now: float = None) -> float:
+        if not self.heap:
+            return sleep_sys_msg
+        now = time.time() if now is None else now
+        return max(0.0, self.heap[0][0] - now)
+
+    def due(self, now: float = None) -> list[TgAuto]:
+        now = time.time() if now is None else now
+        result = []
+        while self.heap and self.heap[0][0] <= now:
+            _, when, uid = heapq.heappop(self.heap)
+            if uid not in self.running:
+                self.running.add(uid)
+                result.append(self.autos[uid])
+            when = self.schedules[uid].next_run(when)
+            if when <= now:
+                # Runs missed while the bot was busy or asleep are skipped, not caught up
+                when = self.schedules[uid].next_run(now)
+            heapq.heappush(self.heap, (when + random.uniform(0, auto_jitter), when, uid))
+        return result
+
+    def done(self, auto: TgAuto) -> None:
+        self.running.discard(auto.id)
@@ -0,0 +1,123 @@
+import time
+import asyncio
+from dataclasses import dataclass, field
+
+from module.core_metrics import metrics
+
+from module.config import send_concurrency, send_rate, send_chat_rate, send_chat_burst, send_retries, send_max_wait
+
+class TokenBucket():
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = time.monotonic()
+
+    def __fill__(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def delay(self) -> float:
+        # Take a token, return how long the caller has to wait for it
+        self.__fill__()
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def take(self) -> bool:
+        # Take a token only if one is available now
+        self.__fill__()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def full(self) -> bool:
+        self.__fill__()
+        return self.tokens >= self.capacity
+
+    async def acquire(self) -> None:
+        delay = self.delay()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+@dataclass
+class SendStats:
+    sent: int = 0
+    failed: int = 0
+    flood_wait: int = 0
+    elapsed: float = 0.0
+    errors: list = field(default_factory=list)
+    # chat -> send results in message order, None for a failed message
+    results: dict = field(default_factory=dict)
+
+    def __str__(self) -> str:
+        rate = self.sent / self.elapsed if self.elapsed > 0 else 0.0
+        return f'sent={self.sent} failed={self.failed} flood_wait={self.flood_wait} time={self.elapsed:.2f}s rate={rate:.1f}/s'
+
+class CoreSender():
+    # Concurrent message fan-out within Telegram limits:
+    # a global token bucket, one bucket per chat and a per chat flood wait
+    def __init__(self, send, flood_error: type = None,
+                 concurrency: int = send_concurrency, rate: float = send_rate,
+                 chat_rate: float = send_chat_rate, chat_burst: int = send_chat_burst) -> None:
+        self.send = send
+        self.flood_error = flood_error
+        self.concurrency = concurrency
+        # Shared by every fan_out, created on the running loop by the first one
+        self.sem = None
+        self.bucket = TokenBucket(rate, rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        # chat -> TokenBucket
+        self.chat_buckets = {}
+        # chat -> monotonic time the flood wait ends
+        self.blocked = {}
+
+    async def fan_out(self, messages: list, send = None) -> SendStats:
+        # messages: [(chat, msg), ...], order is kept within a chat.
+        # send overrides the send coroutine for this call, the limits stay shared
+        stats = SendStats()
+        start = time.monotonic()
+        chats = {}
+        for chat, msg in messages:
+            chats.setdefault(chat, []).append(msg)
+        if self.sem is None:
+            self.sem = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*[self.__send_chat__(send or self.send, chat, msgs, self.sem, stats) for chat, msgs in chats.items()])
+        stats.elapsed = time.monotonic() - start
+        return stats
+
+    async def __send_chat__(self, send, chat, msgs: list, sem: asyncio.Semaphore, stats: SendStats) -> None:
+        bucket = self.chat_buckets.get(chat)
+        if bucket is None:
+            bucket = self.chat_buckets[chat] = TokenBucket(self.chat_rate, self.chat_burst)
+        results = stats.results[chat] = [None] * len(msgs)
+        for n, msg in enumerate(msgs):
+            for attempt in range(send_retries + 1):
+                wait = self.blocked.get(chat, 0) - time.monotonic()
+                if wait > send_max_wait:
+                    # Flood wait too long for this cycle, skip the chat
+                    stats.failed += len(msgs) - n
+                    stats.errors.append(f'{chat}: flood wait {wait:.0f}s, {len(msgs) - n} messages dropped')
+                    return
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                await bucket.acquire()
+                async with sem:
+                    await self.bucket.acquire()
+                    try:
+                        with metrics.timer('send', 'auto'):
+                            results[n] = await send(chat, msg)
+                        stats.sent += 1
+                        break
+                    except Exception as e:
+                        if self.flood_error is not None and isinstance(e, self.flood_error):
+                            # Back off this chat only, the others keep sending
+                            stats.flood_wait += 1
+                            self.blocked[chat] = time.monotonic() + e.seconds
+                            if attempt < send_retries:
+                                continue
+                        stats.failed += 1
+                        stats.errors.append(f'{chat}: {e}')
+                        break
@@ -0,0 +1,94 @@
+import os
+import time
+import pickle
+from collections import OrderedDict
+
+from module.core_class import ChatState
+
+from module.config import state_ttl, state_size, state_path
+
+class CoreState():
+    # Per chat navigation state, keyed by Request.chat_id.
+    # The OrderedDict is kept in order of last use, so the expired and the least recently
+    # used chats are always at the front: get and eviction are O(1), memory is capped at size
+    def __init__(self, ttl: float = state_ttl, size: int = state_size, path: str = state_path) -> None:
+        self.ttl = ttl
+        self.size = size
+        self.path = path
+        # chat_id -> ChatState
+        self.chats = OrderedDict()
+        self.evicted = 0
+
+    def get(self, chat_id: int) -> ChatState:
+        # State of a chat, None for an unknown or expired chat
+        state = self.chats.get(chat_id)
+        if state is None:
+            return None
+        now = time.time()
+        if self.ttl > 0 and state.touched < now - self.ttl:
+            del self.chats[chat_id]
+            self.evicted += 1
+            return None
+        state.touched = now
+        self.chats.move_to_end(chat_id)
+        return state
+
+    def state(self, chat_id: int) -> ChatState:
+        # State of a chat, created on first use
+        state = self.get(chat_id)
+        if state is None:
+            state = self.chats[chat_id] = ChatState(touched=time.time())
+            self.__evict__()
+        return state
+
+    def scratch(self, chat_id: int, uid: str) -> dict:
+        # Scratch data of one plugin in a chat
+        state = self.state(chat_id)
+        if state.data is None:
+            state.data = {}
+        return state.data.setdefault(uid, {})
+
+    def drop(self, chat_id: int) -> None:
+        self.chats.pop(chat_id, None)
+
+    def __evict__(self) -> None:
+        oldest = time.time() - self.ttl
+        while self.chats:
+            chat_id, state = next(iter(self.chats.items()))
+            if len(self.chats) <= self.size and (self.ttl <= 0 or state.touched >= oldest):
+                break
+            del self.chats[chat_id]
+            self.evicted += 1
+
+    def dump(self) -> list:
+        # Plain tuples for save(), taken on the loop, the pickling can run elsewhere
+        return [(chat_id, s.menu, s.msg_id, s.data, s.touched, s.page) for chat_id, s in self.chats.items()]
+
+    def save(self, items: list = None) -> None:
+        if self.path is None:
+            return
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(self.dump() if items is None else items, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.path)
+
+    def load(self) -> int:
+        # Snapshot of the previous run, expired chats are skipped; returns the number loaded
+        if self.path is None or not os.path.isfile(self.path):
+            return 0
+        oldest = time.time() - self.ttl
+        try:
+            with open(self.path, 'rb') as f:
+                items = pickle.load(f)
+            for chat_id, menu, msg_id, data, touched, page in items:
+                if self.ttl <= 0 or touched >= oldest:
+                    self.chats[chat_id] = ChatState(menu=menu, msg_id=msg_id, data=data, touched=touched, page=page)
+        except Exception:
+            # Unreadable or older format, start without it
+            self.chats.clear()
+            return 0
+        self.__evict__()
+        return len(self.chats)
+
+    def __str__(self) -> str:
+        return f'chats={len(self.chats)}/{self.size} evicted={self.evicted}'
@@ -0,0 +1,115 @@
+# Storage backend of CoreDbConfig: pooled engines tuned per database, and awaitable
+# DB access for the bot. Any SQLAlchemy URL works: sqlite:///... (WAL, busy timeout,
+# prepared statement cache) or postgresql+psycopg://... (pre-ping, recycle).
+# The async side is either an async engine (db_async_conn_str, e.g. sqlite+aiosqlite:///...,
+# postgresql+asyncpg://...) or, without one, a thread pool the size of the connection pool.
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+
+from module.core_class import TgConnect, TgMenu, TgButton, TgTextCmd, TgAuto
+from module.core_exception import CoreException
+
+from module.config import db_conn_str, db_async_conn_str, db_pool_size, db_max_overflow, db_wal, db_busy_timeout
+
+def engine_options(conn_str: str) -> dict:
+    url = make_url(conn_str)
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            return {}
+        # sqlite3 keeps this many prepared statements per connection
+        return {'pool_size': db_pool_size, 'max_overflow': db_max_overflow,
+                'connect_args': {'timeout': db_busy_timeout / 1000, 'cached_statements': 256}}
+    return {'pool_size': db_pool_size, 'max_overflow': db_max_overflow, 'pool_pre_ping': True, 'pool_recycle': 1800}
+
+def __sqlite_pragmas__(engine: Engine) -> None:
+    # WAL: readers never wait for the writer, so several bots can share one DB file
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_conn, record):
+        cursor = dbapi_conn.cursor()
+        if db_wal:
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute(f'PRAGMA busy_timeout={int(db_busy_timeout)}')
+        # Enforce the foreign keys like the other databases do
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+def create_storage_engine(conn_str: str = db_conn_str) -> Engine:
+    engine = create_engine(conn_str, echo=False, **engine_options(conn_str))
+    if engine.dialect.name == 'sqlite':
+        __sqlite_pragmas__(engine)
+    return engine
+
+def create_async_storage_engine(conn_str: str = db_async_conn_str):
+    try:
+        from sqlalchemy.pool import AsyncAdaptedQueuePool
+        from sqlalchemy.ext.asyncio import create_async_engine
+        options = engine_options(conn_str)
+        if 'pool_size' in options:
+            # Async SQLite drivers default to no pooling at all
+            options['poolclass'] = AsyncAdaptedQueuePool
+        engine = create_async_engine(conn_str, echo=False, **options)
+    except ImportError as e:
+        raise CoreException(msg=f'Async DB driver for <{conn_str}> is not installed', data=[str(e)])
+    if engine.dialect.name == 'sqlite':
+        __sqlite_pragmas__(engine.sync_engine)
+    return engine
+
+class CoreAsyncDb():
+    # Awaitable CoreDbConfig calls, the event loop never waits for the DB
+    def __init__(self, db, conn_str: str = db_async_conn_str) -> None:
+        self.db = db
+        self.engine = None if conn_str is None else create_async_storage_engine(conn_str)
+        self.executor = None if self.engine is not None else ThreadPoolExecutor(max_workers=db_pool_size, thread_name_prefix='db')
+
+    async def __run__(self, name: str, *args):
+        if self.engine is None:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, getattr(self.db, name), *args)
+        # The same CoreDbConfig code, bound to a connection of the async engine
+        async with self.engine.connect() as conn:
+            return await conn.run_sync(lambda sync_conn: getattr(self.db.bound(sync_conn), name)(*args))
+
+    async def close(self) -> None:
+        if self.engine is not None:
+            await self.engine.dispose()
+        else:
+            self.executor.shutdown(wait=False)
+
+    async def get_version(self) -> str:
+        return await self.__run__('get_version')
+
+    async def get_connect(self) -> TgConnect:
+        return await self.__run__('get_connect')
+
+    async def get_all_connect(self, sessions: list[str]) -> list[TgConnect]:
+        return await self.__run__('get_all_connect', sessions)
+
+    async def get_auto_users(self) -> list[str]:
+        return await self.__run__('get_auto_users')
+
+    async def get_menu(self, menu_text: str) -> TgMenu:
+        return await self.__run__('get_menu', menu_text)
+
+    async def get_text_cmd(self, txt_cmd_text: str) -> TgTextCmd:
+        return await self.__run__('get_text_cmd', txt_cmd_text)
+
+    async def get_button(self, data: str) -> TgButton:
+        return await self.__run__('get_button', data)
+
+    async def get_all_tg_auto(self) -> list[TgAuto]:
+        return await self.__run__('get_all_tg_auto')
+
+    async def get_auto_last_run(self) -> dict:
+        return await self.__run__('get_auto_last_run')
+
+    async def set_auto_last_run(self, auto_id: int, last_run: float) -> None:
+        return await self.__run__('set_auto_last_run', auto_id, last_run)
+
+    async def get_auto_sent(self, auto_id: int) -> dict:
+        return await self.__run__('get_auto_sent', auto_id)
+
+    async def set_auto_sent(self, auto_id: int, sent: dict) -> None:
+        return await self.__run__('set_auto_sent', auto_id, sent)
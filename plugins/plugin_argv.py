@@ -5,6 +5,9 @@ uid = str('plugin_argv')
 info = str(f'Plugin info: <{uid}>')
 
 class Plugin():
+    # Same args - same reply, Core caches it for 30 s
+    cache_ttl = 30
+
     def __init__(self, args: list = [], params: dict = {}) -> None:
         self.params = params
         self.help = str('')
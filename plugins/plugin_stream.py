@@ -0,0 +1,26 @@
+from module.core_class import Reply, ReplyType
+import asyncio
+
+uid = str('plugin_stream')
+info = str(f'Plugin info: <{uid}>')
+
+class Plugin():
+    def __init__(self, args: list = [], params: dict = {}) -> None:
+        self.params = params
+        self.count = int(params.get('count', 3)) if params else 3
+
+    # Return plugin UID
+    @staticmethod
+    def get_uid() -> str:
+        return uid
+
+    # Return plugin Info
+    @staticmethod
+    def get_info() -> str:
+        return info
+
+    # Streaming execution: every yielded Reply is sent as soon as it is ready
+    async def run(self):
+        for i in range(self.count):
+            await asyncio.sleep(0)
+            yield Reply(type=ReplyType.message, text='', data=[f'Plugin <{uid}> chunk {i + 1}/{self.count}.'])
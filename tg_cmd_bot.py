@@ -1,33 +1,82 @@
 # Skeleton tg cmd bot
 
 import os
-import logging
+import time
+import threading
+from types import SimpleNamespace
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
 
 from telethon import TelegramClient, events, Button
 from telethon.tl.patched import Message
-from telethon.errors import FloodWaitError
+from telethon.errors import FloodWaitError, MessageNotModifiedError
 import asyncio
 
-from module.config import print_log, log_path, sleep_sys_msg
+from module.config import print_log, log_path, sleep_sys_msg, plugin_watch, config_watch, overload_msg, sessions, queue_workers
+from module.config import metrics_enabled, metrics_host, metrics_port, state_save
 from module.core import Core
-from module.core_class import TgConnect, Request, SignalType, Reply, ReplyType
+from module.core_dispatch import CoreDispatch
+from module.core_sender import CoreSender
+from module.core_scheduler import CoreScheduler
+from module.core_dedup import CoreDedup
+from module.core_limit import CoreLimiter
+from module.core_queue import CoreQueue
+from module.core_metrics import metrics
+from module.core_log import get_logger, log_context, dropped
+from module.core_class import TgConnect, Request, SignalType, Reply, ReplyType, TgAuto, PluginCall
 from module.core_exception import CoreException
 
 
-py_logger = logging.getLogger(__name__)
-py_logger.setLevel(logging.INFO)
-py_handler = logging.FileHandler(os.path.join(log_path, 'tg_cmd_bot.log'), mode='a')
-py_formatter = logging.Formatter("%(asctime)s %(levelname)s %(message)s")
-py_handler.setFormatter(py_formatter)
-py_logger.addHandler(py_handler)
-if print_log: py_logger.addHandler(logging.StreamHandler())
+py_logger = get_logger(__name__, os.path.join(log_path, 'tg_cmd_bot.log'), print_log)
 
-'''Connect to the Core and initialize the telegram client'''
+'''Connect to the Core and initialize the telegram clients.
+The Core is built in a worker thread, the main client connects as soon as the
+connect settings are read, while the plugins and the config are still checked.
+The other sessions share the Core and get their own client and send limits'''
 try:
-    core = Core()
-    cfg = core.get_tg_connect()
-    py_logger.info(f'''RUN TG CMD BOT: <{cfg.session}>''')
-    client = TelegramClient(session=cfg.session, api_id=cfg.api_id, api_hash=cfg.api_hash).start(bot_token=cfg.token)
+    startup = time.perf_counter()
+    connect = []
+    connect_ready = threading.Event()
+    def on_connect(tg_connect: TgConnect):
+        connect.append(tg_connect)
+        connect_ready.set()
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        core_future = pool.submit(Core, on_connect)
+        while not connect_ready.wait(0.05):
+            if core_future.done():
+                # Startup failed before the connect settings were known
+                core_future.result()
+                break
+        cfg = connect[0] if connect else core_future.result().get_tg_connect()
+        py_logger.info(f'''RUN TG CMD BOT: <{cfg.session}>''')
+        connect_start = time.perf_counter()
+        client = TelegramClient(session=cfg.session, api_id=cfg.api_id, api_hash=cfg.api_hash).start(bot_token=cfg.token)
+        connect_time = time.perf_counter() - connect_start
+        core = core_future.result()
+    # session -> TelegramClient, the main session first
+    clients = {cfg.session: client}
+    for tg_connect in core.get_tg_connects(sessions):
+        if tg_connect.session not in clients:
+            py_logger.info(f'''RUN TG CMD BOT: <{tg_connect.session}>''')
+            clients[tg_connect.session] = TelegramClient(session=tg_connect.session, api_id=tg_connect.api_id,
+                                                         api_hash=tg_connect.api_hash).start(bot_token=tg_connect.token)
+    # session -> CoreSender, send rate accounting per bot token
+    senders = {name: CoreSender(c.send_message, flood_error=FloodWaitError) for name, c in clients.items()}
+    dispatch = CoreDispatch(core)
+    dedup = CoreDedup(core)
+    limiter = CoreLimiter()
+    inbound = CoreQueue()
+    metrics.gauge('requests_inflight', lambda: len(limiter.running))
+    metrics.gauge('queue_depth', inbound.depth)
+    metrics.gauge('plugins_waiting', lambda: dispatch.waiting)
+    metrics.gauge('plugins_running', lambda: dispatch.running)
+    metrics.gauge('result_cache_entries', lambda: len(core.results.entries))
+    metrics.gauge('log_dropped', dropped)
+    metrics.gauge('chat_states', lambda: len(core.states.chats))
+    py_logger.info('Startup: ' + ' '.join(f'''{k}={v * 1000:.0f}ms''' for k, v in core.timing.items()) +
+                   f''' telegram={connect_time * 1000:.0f}ms total={(time.perf_counter() - startup) * 1000:.0f}ms''')
+    for w in core.warnings:
+        py_logger.warning(w)
 except CoreException as e:
     py_logger.critical(f'{e.msg}')
     for s in e.data:
@@ -38,91 +87,314 @@ except Exception as x:
     exit(2)
 
 
-async def core_request(request: Request):
-    # Processing the request and returning data
+# (menu text, page) -> (reply data, reply markup), valid while Core returns the same data object
+markup_cache = {}
+
+def get_markup(reply: Reply):
+    # reply.data: rows of (button text, button data), the last row of a paged menu holds the page buttons
+    key = (reply.text, reply.data[-1] if reply.data else None)
+    cached = markup_cache.get(key)
+    if cached is None or cached[0] is not reply.data:
+        if len(markup_cache) >= 4096:
+            # Pages of old configs
+            markup_cache.clear()
+        cached = (reply.data, client.build_reply_markup([[Button.inline(btn[0], btn[1]) for btn in row] for row in reply.data]))
+        markup_cache[key] = cached
+    return cached[1]
+
+
+def session_of(event) -> str:
+    # Session of the client that received the event
+    for name, c in clients.items():
+        if c is getattr(event, 'client', client):
+            return name
+    return cfg.session
+
+async def send_reply(request: Request, reply: Reply, session: str):
+    client = clients[session]
+    bucket = senders[session].bucket
+    if ReplyType.message == reply.type:
+        for msg in reply.data:
+            await bucket.acquire()
+            with metrics.timer('send', 'message'):
+                await client.send_message(request.chat_id, msg)
+    elif ReplyType.error == reply.type:
+        if reply.text is not None:
+            await bucket.acquire()
+            with metrics.timer('send', 'error'):
+                await client.send_message(request.chat_id, reply.text)
+            py_logger.error(f'''{reply.text}''')
+        for e in reply.data:
+            py_logger.error(f'''{e}''')
+    elif ReplyType.menu == reply.type:
+        buttons = get_markup(reply)
+        await bucket.acquire()
+        with metrics.timer('send', 'menu'):
+            if  reply.rewrite:
+                await client.edit_message(request.username, request.msg_id, reply.text, buttons=buttons)
+            else:
+                sent = await client.send_message(request.chat_id, reply.text, buttons=buttons)
+                core.states.state(request.chat_id).msg_id = sent.id
+
+async def core_request(request: Request, session: str):
+    # Processing the request and returning data, streaming plugins are sent chunk by chunk.
+    # Plain send_message instead of a conversation, so replies to one chat can interleave
+    command = core.command_label(request)
+    start = time.perf_counter()
+    with log_context(username=request.username, chat_id=request.chat_id, command=command, session=session):
+        try:
+            with metrics.timer('request', command):
+                async for reply in dispatch.stream(request):
+                    await send_reply(request, reply, session)
+
+        except CoreException as e:
+            py_logger.error(f'{e.msg}')
+            for s in e.data:
+                py_logger.error(f'  {s}')
+        except Exception as x:
+            py_logger.error(x.args[0])
+        py_logger.info('Request done', extra={'duration': time.perf_counter() - start})
+
+async def limited_request(request: Request, session: str):
+    # Per user rate limit and coalescing of repeated clicks in front of core_request
+    status = await limiter.run(request, lambda r: core_request(r, session), session)
+    if 'overload' == status:
+        await clients[session].send_message(request.chat_id, overload_msg)
+    elif 'accepted' != status:
+        py_logger.info(f'''Request <{request.data}> from <{request.username}>: {status}''')
+
+async def queued_request(request: Request, session: str):
+    # Inbound queue worker side
     try:
-        reply = core.user_request(request)
+        await limited_request(request, session)
+    except Exception as e:
+        py_logger.error(f'''Error processing request <{request.data}> from <{request.username}>: {e}''')
+
+async def put_request(request: Request, session: str):
+    # Handler side: queue the request and return, buttons go ahead of plugin text commands.
+    # Returns a future done when the request is handled, None if it was answered "busy"
+    if queue_workers <= 0:
+        await limited_request(request, session)
+        return None
+    done = inbound.put(request, session, core.request_lane(request))
+    if done is None:
+        await clients[session].send_message(request.chat_id, overload_msg)
+    return done
+
+async def handle_stats_log():
+    # Limiter and result cache counters, only when something happened since the last report
+    last = None
+    while True:
+        await asyncio.sleep(sleep_sys_msg)
+        stats = (dict(limiter.counters), dict(inbound.counters), core.results.hits, core.results.misses, dropped())
+        if last != stats:
+            last = stats
+            py_logger.info(f'''Requests: {limiter}''')
+            py_logger.info(f'''Inbound queue: {inbound}''')
+            py_logger.info(f'''Result cache: {core.results}''')
+            if dropped():
+                py_logger.warning(f'''Log records dropped: {dropped()}''')
+
+async def send_or_edit(chat, item: tuple):
+    # item: (msg, message id to edit or None); a failed edit falls back to a new message
+    msg, msg_id = item
+    if msg_id is not None:
+        try:
+            return await client.edit_message(chat, msg_id, msg)
+        except FloodWaitError:
+            raise
+        except MessageNotModifiedError:
+            # This part of the output did not change, the message stays as it is
+            return SimpleNamespace(id=msg_id)
+        except Exception as e:
+            py_logger.warning(f'''Edit message {msg_id} in <{chat}> failed: {e}''')
+    return await client.send_message(chat, msg)
+
+async def run_auto(sender: CoreSender, scheduler: CoreScheduler, auto: TgAuto):
+    # One scheduled auto task: run the plugin and fan the reply out to the auto users
+    started = time.time()
+    try:
+        reply = await dispatch.run(PluginCall(uid=auto.plugin_uid, args=[], params=auto.params))
         if reply is None:
             return
-        async with client.conversation(request.chat_id) as conv:
-            if ReplyType.message == reply.type:
-                for msg in reply.data:
-                    await conv.send_message(msg)
-            elif ReplyType.error == reply.type:
-                if reply.text is not None:
-                    await conv.send_message(reply.text)
-                    py_logger.error(f'''{reply.text}''')
-                for e in reply.data:
-                    py_logger.error(f'''{e}''')
-            elif ReplyType.menu == reply.type:
-                buttons = [[Button.inline(btn[0], btn[1])] for btn in reply.data]
-                if  reply.rewrite:
-                    await client.edit_message(request.username, request.msg_id, reply.text, buttons=buttons)
-                else:
-                    await conv.send_message(reply.text, buttons=buttons)
-
+        if ReplyType.error == reply.type:
+            for e in reply.data:
+                py_logger.error(f'''{e}''')
+            return
+        users = core.get_auto_users()
+        loop = asyncio.get_running_loop()
+        if auto.dedup is None:
+            messages = [(user, msg) for user in users for msg in reply.data]
+            send = None
+        else:
+            digest, messages = await loop.run_in_executor(None, dedup.plan, auto, users, reply)
+            send = send_or_edit
+        if messages:
+            stats = await sender.fan_out(messages, send=send)
+            py_logger.info(f'''System message <{auto.plugin_uid}>: {stats}''')
+            for e in stats.errors:
+                py_logger.warning(f'''  {e}''')
+            if auto.dedup is not None:
+                await loop.run_in_executor(None, dedup.commit, auto, users, digest, stats.results)
     except CoreException as e:
-        py_logger.error(f'{e.msg}')
-        for s in e.data:
-            py_logger.error(f'  {s}')
-    except Exception as x:
-        py_logger.error(x.args[0])
+        py_logger.warning(f'''Error sysyem message <{auto.plugin_uid}>: {e.msg}''')
+    except Exception as e:
+        py_logger.warning(f'''Error sysyem message <{auto.plugin_uid}>: {e}''')
+    finally:
+        scheduler.done(auto)
+        try:
+            await core.adb.set_auto_last_run(auto.id, started)
+        except Exception as e:
+            py_logger.warning(f'''Error saving last run <{auto.plugin_uid}>: {e}''')
 
 async def handle_system_message():
-    # Automatic sending of system messages
+    # Automatic sending of system messages, every TgAuto on its own schedule
+    sender = senders[cfg.session]
+    snapshot = None
+    scheduler = None
+    tasks = set()
     while True:
+        delay = sleep_sys_msg
         try:
-            for reply in core.auto_request():
-                for user in core.get_auto_users():
-                    for msg in reply.data:
-                        await client.send_message(user, msg)
+            if snapshot is not core.config.snapshot:
+                # Config reloaded: rebuild the schedule from the persisted last runs.
+                # The snapshot is remembered only once that worked, a failure is retried.
+                # The jobs still in flight stay in the running set, so they are not started twice
+                current = core.config.snapshot
+                last_run = await core.adb.get_auto_last_run()
+                scheduler = CoreScheduler(current.auto, last_run, running=None if scheduler is None else scheduler.running)
+                snapshot = current
+            for auto in scheduler.due():
+                task = asyncio.create_task(run_auto(sender, scheduler, auto))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            delay = min(scheduler.next_delay(), sleep_sys_msg)
         except Exception as e:
             py_logger.warning(f'''Error sysyem message: {e}''')
-            await asyncio.sleep(sleep_sys_msg)
-        await asyncio.sleep(sleep_sys_msg)
+        await asyncio.sleep(delay)
+
+
+async def save_states():
+    # Snapshot of the chat states, taken on the loop and written in the default executor
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, core.states.save, core.states.dump())
+    except Exception as e:
+        py_logger.warning(f'''Error saving chat states: {e}''')
+
+async def handle_state_save():
+    while True:
+        await asyncio.sleep(state_save)
+        await save_states()
+        py_logger.info(f'''Chat states: {core.states}''')
+
+
+async def handle_plugin_watch():
+    # Hot-reload of changed plugin files, imports run in the default executor
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(plugin_watch)
+        try:
+            if await loop.run_in_executor(None, core.pl.refresh):
+                py_logger.info(f'''Plugins reloaded: {core.pl.plugins()}''')
+                for e in core.pl.errors:
+                    py_logger.error(f'''  {e}''')
+        except Exception as e:
+            py_logger.warning(f'''Error plugin watch: {e}''')
+
+
+async def handle_config_watch():
+    # Reload the config snapshot after config_tg_bot.py changed the DB
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(config_watch)
+        try:
+            if await core.adb.get_version() != core.version:
+                # Read and checked in the default executor, swapped in on the loop
+                snapshot = await loop.run_in_executor(None, core.read_config)
+                if snapshot is not None:
+                    core.apply_config(snapshot)
+                    py_logger.info(f'''Config reloaded''')
+                else:
+                    py_logger.error(f'''Config reload rejected, keep the previous config''')
+                    for e in core.db.get_errors():
+                        py_logger.error(f'''  {e}''')
+        except Exception as e:
+            py_logger.warning(f'''Error config watch: {e}''')
 
 
-@client.on(events.NewMessage(func=lambda e: e.is_private))
 async def handle_new_message(event):
     # Receiving new messages from a user
     try:
         sender = await event.get_sender()
         message = event.message
-        await core_request(Request(type=SignalType.text_cmd,
+        return await put_request(Request(type=SignalType.text_cmd,
                                    chat_id=message.chat.id,
                                    msg_id=message.id,
                                    username=sender.username,
                                    data=str(message.message)
-                                  )
+                                  ),
+                          session_of(event)
                           )
     except Exception as e:
         py_logger.error(f'''Error processing new message: {e}''')
 
-@client.on(events.CallbackQuery())
 async def handle_new_data(event):
     # Receiving new data(button click) from a user
     try:
         sender = await event.get_sender()
-        await core_request(Request(type=SignalType.button,
+        return await put_request(Request(type=SignalType.button,
                                    chat_id= event.chat.id,
                                    msg_id=event.message_id,
                                    username=sender.username,
                                    data=str(event.data.decode('utf-8'))
-                                  )
+                                  ),
+                          session_of(event)
                           )
     except Exception as e:
         py_logger.error(f'''Error processing new data: {e}''')
 
+for c in clients.values():
+    c.on(events.NewMessage(func=lambda e: e.is_private))(handle_new_message)
+    c.on(events.CallbackQuery())(handle_new_data)
+
 async def main():
+    # The config DB (SQLAlchemy import, engine, schema check) opens in the default executor,
+    # the periodic tasks below use it from the loop
+    await asyncio.get_running_loop().run_in_executor(None, lambda: core.adb)
+    if plugin_watch > 0:
+        watch_task = asyncio.create_task(handle_plugin_watch())
+    if config_watch > 0:
+        config_task = asyncio.create_task(handle_config_watch())
+    stats_task = asyncio.create_task(handle_stats_log())
+    if state_save > 0:
+        state_task = asyncio.create_task(handle_state_save())
+    if queue_workers > 0:
+        await inbound.start(queued_request)
+        if inbound.counters['replayed'] or inbound.counters['expired']:
+            py_logger.info(f'''Inbound queue: {inbound}''')
+    if metrics_enabled and metrics_port > 0:
+        metrics_server = await metrics.serve(metrics_host, metrics_port)
+        py_logger.info(f'''Metrics: http://{metrics_host}:{metrics_port}/metrics''')
+    # Auto messages run beside the clients, every session serves until it disconnects
+    system_task = asyncio.create_task(handle_system_message())
     try:
-        await handle_system_message()
+        await asyncio.gather(*[c.run_until_disconnected() for c in clients.values()])
     except FloodWaitError as e:
         py_logger.error(f'''Account blocked! Try again in {e.seconds} seconds''')
-        return
-    await client.run_until_disconnected()
+    finally:
+        system_task.cancel()
+        # Workers stop and the writer thread flushes the deletes of the answered requests
+        await inbound.stop()
+        await save_states()
 
 if __name__ == '__main__':
-    with client:
-        client.loop.run_until_complete(
-            main()
-        )
\ No newline at end of file
+    with ExitStack() as stack:
+        for c in clients.values():
+            stack.enter_context(c)
+        try:
+            client.loop.run_until_complete(
+                main()
+            )
+        except KeyboardInterrupt:
+            # The loop stops without running main's finally
+            core.states.save()
\ No newline at end of file